@@ -1,9 +1,15 @@
 import datetime
+import glob
+import json
 import os
+import resource
 import shutil
+import tempfile
+import time
 from subprocess import Popen
 from urllib.parse import urljoin
 
+import numpy as np
 import pandas as pd
 import requests
 import typer
@@ -18,7 +24,6 @@ from forecast_app.models import (
     HistoricalLoadData,
     HistoricalWeatherData,
 )
-from forecast_app.tests.test_weather import TestAsosRequest, TestNwsForecastRequest
 
 typer_app = typer.Typer()
 
@@ -98,6 +103,9 @@ def deploy(
 @typer_app.command()
 def test_apis():
     """Query the ASOS API without a mock to ensure that it works as intended."""
+    # NOTE: The tests need pytest, a dev dependency
+    from forecast_app.tests.test_weather import TestAsosRequest, TestNwsForecastRequest
+
     TestAsosRequest.test_asos_api()
     print("ASOS API test passed.")
     TestNwsForecastRequest.test_nws_api()
@@ -265,10 +273,264 @@ def launch_new_model(
     print("Forecast model has begun training ✓")
 
 
+@typer_app.command()
+def launch_forecast(
+    BASE_URL: str = typer.Option("http://localhost:5000", "--url"),
+    username: str = typer.Option("admin", "--username"),
+    password: str = typer.Option("admin", "--password"),
+):
+    """Forecast with the latest successful model, without training a new one"""
+    session = create_login_session(username, password, BASE_URL)
+    print("Posting request to forecast with the latest model...")
+    session.post(urljoin(BASE_URL, "/forecast-models"), data={"forecast_only": "true"})
+    print("Forecast completed ✓")
+
+
+@typer_app.command()
+def backtest(
+    config: str = "dev",
+    slug: str = typer.Option(
+        None, "--slug", help="Defaults to the latest successful model."
+    ),
+    days: int = typer.Option(None, "--days"),
+    epochs: int = typer.Option(
+        None, "--epochs", help="Set to 0 to replay the model without training."
+    ),
+    processes: int = typer.Option(None, "--processes"),
+):
+    """Forecast each of the last days with a model and report its errors by day and by hour."""
+    app = create_app(config)
+    with app.app_context():
+        if slug is None:
+            model = ForecastModel.get_latest_successful()
+        else:
+            model = ForecastModel.query.filter_by(slug=slug).first()
+        if model is None:
+            print("No model to backtest.")
+            return
+
+        start = time.perf_counter()
+        errors = model.backtest(days=days, epochs=epochs, processes=processes)
+        elapsed = time.perf_counter() - start
+        by_day, by_hour = lf.backtest_tables(errors)
+        print(by_day.to_string())
+        print(by_hour.to_string())
+        print(
+            f"Backtested {model.slug} on {len(errors)} days in {elapsed:.2f}s, "
+            f"MAPE: {by_day['mape'].mean():.2f}"
+        )
+        print(f"Errors stored in {model.backtest_path}")
+
+
+@typer_app.command()
+def benchmark_load_data(
+    filepath: str = typer.Option(
+        "forecast_app/static/demo-data/demo-ncent-historical-load.csv", "--filepath"
+    ),
+    config: str = "test",
+):
+    """Compare the bulk and row-by-row ingest paths of `load_data` on a throwaway database."""
+    app = create_app(config)
+    # Never touch the config's real database
+    tmp_dir = tempfile.mkdtemp()
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_dir}/benchmark.db"
+
+    with app.app_context():
+        df = HistoricalLoadData.prepare_df(pd.read_csv(filepath))
+        print(f"Benchmarking {df.shape[0]} rows from {filepath}")
+
+        paths = {
+            "row-by-row": HistoricalLoadData._orm_upsert_df,
+            "bulk": HistoricalLoadData.upsert_df,
+        }
+        for name, upsert in paths.items():
+            init_db()
+            # First upload is into an empty table, the second updates every row
+            for upload in ["empty table", "populated table"]:
+                start = time.perf_counter()
+                counts = upsert(df.copy())
+                elapsed = time.perf_counter() - start
+                print(f"{name:>10} into {upload}: {elapsed:8.2f}s {counts}")
+
+    shutil.rmtree(tmp_dir)
+
+
+def peak_rss_mib():
+    """Return the peak resident memory of this process so far, in MiB (linux only)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@typer_app.command()
+def benchmark_data_split(
+    filepath: str = typer.Option(
+        "forecast_app/static/demo-data/cached-dataframe.csv", "--filepath"
+    ),
+    epochs: int = typer.Option(1, "--epochs", help="Set to 0 to skip training."),
+    streaming: bool = typer.Option(False, "--streaming"),
+    float64: bool = typer.Option(
+        False, "--float64", help="Build float64 arrays to compare with float32."
+    ),
+):
+    """Report the time and peak memory used to build a DataSplit and train on it."""
+    df = pd.read_csv(filepath, parse_dates=["dates"])
+    # NOTE: Peak RSS never decreases, so report the increase over the baseline
+    baseline = peak_rss_mib()
+
+    start = time.perf_counter()
+    data_split = lf.DataSplit(df, dtype=np.float64 if float64 else np.float32)
+    elapsed = time.perf_counter() - start
+    print(f"DataSplit: {elapsed:.2f}s, peak RSS +{peak_rss_mib() - baseline:.0f} MiB")
+
+    if epochs:
+        start = time.perf_counter()
+        lf.train_and_test_model(data_split, epochs=epochs, streaming=streaming)
+        elapsed = time.perf_counter() - start
+        print(
+            f"Training: {elapsed:.2f}s, peak RSS +{peak_rss_mib() - baseline:.0f} MiB"
+        )
+
+
+@typer_app.command()
+def benchmark_ensemble(
+    filepath: str = typer.Option(
+        "forecast_app/static/demo-data/cached-dataframe.csv", "--filepath"
+    ),
+    members: int = typer.Option(4, "--members"),
+    epochs: int = typer.Option(1, "--epochs"),
+    processes: int = typer.Option(
+        None, "--processes", help="Defaults to one per member, capped by the CPUs."
+    ),
+):
+    """Report the wall-clock time to train an ensemble sequentially and in parallel."""
+    df = pd.read_csv(filepath, parse_dates=["dates"])
+    print(f"CPUs: {os.cpu_count()}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_split = lf.DataSplit(
+            df, feature_store=os.path.join(tmp_dir, "feature-store")
+        )
+        member_files = [
+            os.path.join(tmp_dir, f"ensemble-member-{i}.h5") for i in range(members)
+        ]
+        elapsed = {}
+        for label, pool_size in [("Sequential", 1), ("Parallel", processes)]:
+            start = time.perf_counter()
+            _, accuracy = lf.train_ensemble(
+                data_split, member_files, epochs=epochs, processes=pool_size
+            )
+            elapsed[label] = time.perf_counter() - start
+            print(
+                f"{label}: {elapsed[label]:.2f}s, "
+                f"Train: {accuracy['train']}, Test: {accuracy['test']}"
+            )
+
+    print(f"Speedup: {elapsed['Sequential'] / elapsed['Parallel']:.2f}x")
+
+
+BENCHMARK_DIR = "forecast_app/tests/benchmarks"
+BENCHMARK_STORAGE = os.path.join(BENCHMARK_DIR, "baselines")
+
+
+def benchmark_results(path):
+    """Return the mean time (s) and peak memory (MiB) of each benchmark in a pytest-benchmark JSON file."""
+    with open(path) as f:
+        results = json.load(f)
+    return {
+        benchmark["name"]: (
+            benchmark["stats"]["mean"],
+            benchmark["extra_info"].get("peak_mib"),
+        )
+        for benchmark in results["benchmarks"]
+    }
+
+
+@typer_app.command()
+def benchmark(
+    save: str = typer.Option(
+        None, "--save", help="Store the results as a baseline with this name."
+    ),
+    compare: str = typer.Option(
+        None,
+        "--compare",
+        help="Compare with a stored baseline, by number (e.g. 0001) or name.",
+    ),
+    fail_above: float = typer.Option(
+        None,
+        "--fail-above",
+        help="Fail if a mean time or peak memory grew more than this percentage.",
+    ),
+    keyword: str = typer.Option(
+        None, "--keyword", "-k", help="Only run the matching benchmarks, e.g. 1x."
+    ),
+):
+    """Benchmark the ingest, query and feature stages on the demo data scaled 1x, 5x and 20x"""
+    # NOTE: pytest is a dev dependency, only needed to benchmark
+    import pytest
+
+    baseline_path = None
+    if compare is not None:
+        baselines = sorted(
+            glob.glob(os.path.join(BENCHMARK_STORAGE, "*", f"*{compare}*.json"))
+        )
+        if not baselines:
+            print(f"No baseline matches {compare} in {BENCHMARK_STORAGE}.")
+            raise typer.Exit(1)
+        baseline_path = baselines[-1]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results_path = os.path.join(tmp_dir, "results.json")
+        args = [
+            BENCHMARK_DIR,
+            "--benchmark-only",
+            f"--benchmark-storage={BENCHMARK_STORAGE}",
+            f"--benchmark-json={results_path}",
+            "--benchmark-columns=min,mean,max,rounds",
+        ]
+        if save is not None:
+            args.append(f"--benchmark-save={save}")
+        if keyword is not None:
+            args += ["-k", keyword]
+        exit_code = pytest.main(args)
+        if exit_code != 0:
+            raise typer.Exit(exit_code)
+        results = benchmark_results(results_path)
+
+    if baseline_path is None:
+        return
+
+    # NOTE: pytest-benchmark only compares times, memory is compared here
+    print(f"Compared with {baseline_path}")
+    baseline = benchmark_results(baseline_path)
+    regressions = []
+    print(f"{'Benchmark':<36}{'Mean time (s)':>28}{'Peak memory (MiB)':>28}")
+    for name, (mean, peak_mib) in results.items():
+        if name not in baseline:
+            print(f"{name:<36}{'(new)':>28}")
+            continue
+        columns = []
+        for label, current, previous in [
+            ("time", mean, baseline[name][0]),
+            ("memory", peak_mib, baseline[name][1]),
+        ]:
+            if current is None or previous is None:
+                columns.append("")
+                continue
+            change = (current - previous) / previous * 100 if previous else 0
+            columns.append(f"{previous:.3f} -> {current:.3f} ({change:+.0f}%)")
+            if fail_above is not None and change > fail_above:
+                regressions.append(f"{name} {label} {change:+.0f}%")
+        print(f"{name:<36}{columns[0]:>28}{columns[1]:>28}")
+
+    if regressions:
+        print("Regressions: " + ", ".join(regressions))
+        raise typer.Exit(1)
+
+
 @typer_app.command()
 def test_forecaster(
     num_tests: int = typer.Option(1, "--num-tests"),
     epochs: int = typer.Option(1, "--epochs"),
+    streaming: bool = typer.Option(False, "--streaming"),
 ):
     """Test forecaster from command line, useful for iterating on the model"""
 
@@ -281,7 +543,7 @@ def test_forecaster(
     accuracies = []
     for _ in range(num_tests):
         model, accuracy = lf.train_and_test_model(
-            data_split, epochs=epochs, tensorboard=True
+            data_split, epochs=epochs, tensorboard=True, streaming=streaming
         )
         accuracies.append(accuracy)
         print(
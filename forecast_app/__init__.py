@@ -6,6 +6,8 @@ from flask import Flask, redirect, render_template
 
 from forecast_app import views
 from forecast_app.config import SECRET_VARS, config_map
+from forecast_app.models import TrainingJob
+from forecast_app.serving import model_cache
 from forecast_app.utils import ADMIN_USER, db, login_manager
 
 
@@ -28,6 +30,14 @@ def create_app(config: str):
     login_manager.init_app(app)
     ADMIN_USER.id = app.config["ADMIN_USER"]
 
+    # Initialize the cache of trained models
+    model_cache.init_app(app)
+
+    # Keep the training queue moving once the app serves requests, e.g. after a
+    #  restart. Page views themselves never start workers.
+    if app.config["TRAINING_DISPATCH_SECONDS"]:
+        app.before_first_request(lambda: TrainingJob.start_dispatcher(app))
+
     method_views = [
         views.LoginView,
         views.LogoutView,
@@ -35,8 +45,12 @@ def create_app(config: str):
         views.HistoricalLoadDataView,
         views.ForecastWeatherDataView,
         views.HistoricalWeatherDataView,
+        views.HistoricalLoadDataChart,
+        views.ForecastWeatherDataChart,
+        views.HistoricalWeatherDataChart,
         views.ForecastModelListView,
         views.ForecastModelDetailView,
+        views.ForecastModelPredictView,
         views.HistoricalWeatherDataSync,
         views.ForecastWeatherDataSync,
         views.DownloadModelFiles,
@@ -45,7 +45,7 @@ def upload_demo_data(models=True):
         mock_model = ForecastModel()
         mock_model.loads = mock_load
         mock_model.accuracy = {"test": 4.3, "train": 4.4}
-        mock_model.store_process_id(mock_model.COMPLETED_SUCCESSFULLY)
+        mock_model.store_status(mock_model.COMPLETED_SUCCESSFULLY)
 
         # Copy the cached dataframe to this mock model's
         df = pd.read_csv(demo_data / "cached-dataframe.csv")
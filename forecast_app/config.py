@@ -56,6 +56,39 @@ class Config:
     """Machine learning config"""
     EPOCHS = 1
     HOURS_PRIOR = 24
+    # Feed training data through a tf.data pipeline that builds windows on the fly
+    STREAMING_TRAINING = False
+    # Number of models that can train at once, others wait in a queue
+    TRAINING_WORKERS = 1
+    # Workers update their job's heartbeat this often, a job without one for the
+    #  timeout has failed
+    JOB_HEARTBEAT_SECONDS = 10
+    JOB_HEARTBEAT_TIMEOUT = 60
+    # Each web process starts workers for queued jobs this often, e.g. after a
+    #  restart or when a worker died. None to only start them when a job is queued.
+    TRAINING_DISPATCH_SECONDS = 60
+    # Fine-tune the latest successful model instead of training from scratch
+    WARM_START = False
+    WARM_START_EPOCHS = 3
+    # Fraction of the previously trained windows to replay while fine-tuning
+    WARM_START_REPLAY = 0.1
+    # Train from scratch when the latest model can't be warm started, otherwise fail
+    WARM_START_FALLBACK = True
+    # Train this many models in parallel and forecast with their mean, and the
+    #  spread of their forecasts. One is a single model.
+    ENSEMBLE_MEMBERS = 1
+    # Number of processes to train the members in, by default one per member
+    #  (capped by the number of CPUs)
+    ENSEMBLE_PROCESSES = None
+    # Number of past days to forecast when backtesting a model. With no epochs the
+    #  model's forecasts are replayed, otherwise a model is trained for each day in
+    #  a pool of processes (by default one per day, capped by the number of CPUs)
+    BACKTEST_DAYS = 30
+    BACKTEST_EPOCHS = 0
+    BACKTEST_PROCESSES = None
+    # Bounds of the in-memory cache of trained models used to serve predictions
+    MODEL_CACHE_SIZE = 4
+    MODEL_CACHE_MEGABYTES = 512
 
     """Logo path"""
     LOGO_PATH = "img/demo.png"
@@ -112,6 +145,8 @@ class TestingConfig(Config):
 
     NAME = "test"
 
+    TRAINING_DISPATCH_SECONDS = None
+
     SQLALCHEMY_DATABASE_URI = "sqlite:///db/test.db"
 
     OUTPUT_DIR = "forecast_app/tests/user-content/tmp_output"
@@ -122,6 +157,7 @@ class DemoConfig(Config):
     # FREEZE CONFIGS
     NAME = "demo"
     SQLALCHEMY_DATABASE_URI = "sqlite:///db/demo.db"
+    TRAINING_DISPATCH_SECONDS = None
     FREEZER_DESTINATION = "../demo"
     FREEZER_IGNORE_MIMETYPE_WARNINGS = True
     FREEZER_RELATIVE_URLS = True  # Use relative URLs for static files
@@ -1,12 +1,15 @@
 """A collection of utilities to help with building and executing the machine learning model."""
 
 import datetime
+import json
+import multiprocessing
+import os
 from datetime import date
 
 import numpy as np
 import pandas as pd
 import tensorflow as tf
-from scipy.stats import zscore
+from numpy.lib.stride_tricks import sliding_window_view
 from sklearn.model_selection import train_test_split
 from tensorflow.keras import callbacks, layers
 
@@ -15,135 +18,485 @@ class DataSplit:
     """A class to make the data split consistent across all operations."""
 
     def __init__(
-        self, df, train_size=0.8, hours_prior=24, load_col="load", dt_col="dates"
+        self,
+        df,
+        train_size=0.8,
+        hours_prior=24,
+        load_col="load",
+        dt_col="dates",
+        feature_params=None,
+        dtype=np.float32,
+        feature_store=None,
     ):
-        """Initialize the data split."""
+        """Initialize the data split.
+
+        `feature_params` are the normalization parameters returned by `build_features`.
+        Pass the parameters of a trained model to reproduce its features exactly.
+        Features and targets are `dtype` arrays, float32 matches the model's weights.
+        `feature_store` is a directory to memory map the features from, see
+        `save_feature_store`. If it's missing they are built and saved there. If a
+        model's split was stored there (see `save_split`) it's used instead of a
+        random one.
+        """
         self.df = df
+        self.dtype = dtype
+        self.feature_store = feature_store
         self.hours_prior = hours_prior
         self.load_col = load_col
         self.dt_col = dt_col
+        self.feature_params = feature_params
 
         self.generate_exploded_data()
 
         # TODO: Use last valid index to get the training data.
-        self.test_train_X, self.test_train_y = (
-            self.all_X[:-hours_prior],
-            self.all_y[:-hours_prior],
+        # NOTE: The 3D arrays are views, so the split is kept as indices. Copies
+        #  are only made batch by batch, see `WindowSequence`.
+        split = None if feature_store is None else load_split_indices(feature_store)
+        self.split_is_stored = split is not None
+        if split is None:
+            split = train_test_split(
+                np.arange(self.all_X.shape[0] - hours_prior), train_size=train_size
+            )
+        self.train_indices, self.test_indices = split
+
+    @property
+    def feature_count(self):
+        """Return the number of features per hour."""
+        return self.all_X.shape[2]
+
+    # NOTE: The following properties copy the selected windows. Prefer `sequence`
+    #  to avoid materializing the whole dataset.
+    @property
+    def train_X(self):
+        return self.all_X[self.train_indices]
+
+    @property
+    def train_y(self):
+        return self.all_y[self.train_indices]
+
+    @property
+    def test_X(self):
+        return self.all_X[self.test_indices]
+
+    @property
+    def test_y(self):
+        return self.all_y[self.test_indices]
+
+    def _subset_indices(self, subset):
+        """Return the window indices of a subset, either "train", "test" or an array of indices."""
+        if isinstance(subset, str):
+            return self.train_indices if subset == "train" else self.test_indices
+        return np.asarray(subset)
+
+    def window_dates(self, indices):
+        """Return the timestamps of the first hour of the windows at `indices`."""
+        return self.df[self.dt_col].to_numpy()[np.asarray(indices)]
+
+    def labeled_windows(self):
+        """Return the windows with load data, leaving out the last day like the split."""
+        windows = np.arange(self.all_X.shape[0] - self.hours_prior)
+        return windows[~np.isnan(self.all_y[windows]).any(axis=1)]
+
+    def windows_before(self, since):
+        """Return the windows with load data that end before `since`.
+
+        A model trained on the data before `since` may have been trained on any of them.
+        """
+        windows = self.labeled_windows()
+        window_ends = self.window_dates(windows + self.hours_prior - 1)
+        return windows[window_ends < np.datetime64(since)]
+
+    def save_split(self, train_indices=None, test_indices=None):
+        """Store the windows a model was trained and scored on with the features.
+
+        They default to this split's. Later splits of the feature store use them
+        instead of a random split, so e.g. a backtest knows which days the model saw.
+        """
+        if self.feature_store is None:
+            raise Exception("The split is stored in the feature store.")
+        if train_indices is not None:
+            self.train_indices = np.asarray(train_indices)
+        if test_indices is not None:
+            self.test_indices = np.asarray(test_indices)
+        save_split_indices(self.feature_store, self.train_indices, self.test_indices)
+        self.split_is_stored = True
+
+    def warm_start_split(self, since, replay=0.1, test_size=0.2):
+        """Split the windows to fine-tune a model trained on the data before `since`.
+
+        The windows with load data from `since` on are new to the model, so a
+        `test_size` fraction of them is held out to score it. It's fine-tuned on the
+        others plus a random `replay` fraction of the windows it may have been
+        trained on, which keeps it from forgetting the history. Like the split, the
+        last day is left out, as are windows without load data (e.g. the forecast).
+        Return the training and testing window indices.
+        """
+        old_indices = self.windows_before(since)
+        new_indices = np.setdiff1d(self.labeled_windows(), old_indices)
+        if len(new_indices) < 2:
+            raise Exception(f"There is too little data since {since} to warm start.")
+
+        new_train, new_test = train_test_split(new_indices, test_size=test_size)
+        replayed = np.random.choice(
+            old_indices, int(len(old_indices) * replay), replace=False
         )
+        return np.concatenate([new_train, replayed]), new_test
 
-        self.train_X, self.test_X, self.train_y, self.test_y = train_test_split(
-            self.test_train_X, self.test_train_y, train_size=train_size
+    def sequence(self, subset="train", batch_size=32, shuffle=None):
+        """Return a `WindowSequence` over the training or testing windows.
+
+        `subset` can also be an array of window indices, e.g. from `warm_start_split`.
+        """
+        indices = self._subset_indices(subset)
+        if shuffle is None:
+            shuffle = subset == "train"
+        return WindowSequence(
+            self.all_X, self.all_y, indices, batch_size=batch_size, shuffle=shuffle
         )
 
-    def generate_exploded_data(self, noise=2.5):
-        """Turn a dataframe of datetime and load data into a dataframe useful for machine learning.
+    def dataset(self, subset="train", batch_size=32, shuffle=None):
+        """Return a tf.data.Dataset of batches of the training or testing windows.
 
-        Normalize values, expload categorical data, and add noise to the temperature data to simulate
-        uncertainty in a forecast.
+        Windows are gathered from the 2D features and targets by index as each batch
+        is needed, with batches prepared in parallel and prefetched while training.
         """
+        indices = self._subset_indices(subset)
+        if shuffle is None:
+            shuffle = subset == "train"
 
-        # TODO: Instead of shifting by hours prior, values should be explicitly grabbed by datetime.
-        # TODO: Forecast from any hour not just the first hour of the day
-        # TODO: Sort the dataframe by datetime.
+        features = tf.constant(self.features)
+        targets = tf.constant(self.targets)
+        offsets = tf.range(self.hours_prior, dtype=indices.dtype)
 
-        DT_COL = self.dt_col
-        LOAD_COL = self.load_col
-        hours_prior = self.hours_prior
-        df = self.df
-
-        df["year"] = df[DT_COL].dt.year
-        df["month"] = df[DT_COL].dt.month
-        df["day"] = df[DT_COL].dt.day
-
-        r_df = pd.DataFrame()
-
-        # LOAD
-        r_df["load_n"] = df[LOAD_COL] / (df[LOAD_COL].max() - df[LOAD_COL].min())
-        # NOTE: This requires a sorted, continuous dataframe!
-        r_df["load_prev_n"] = r_df["load_n"].shift(hours_prior)
-        r_df["load_prev_n"].bfill(inplace=True)
-
-        # Remove normalized load from Xs, otherwise you're just feeding the answers into the model.
-        r_df.drop(["load_n"], axis=1, inplace=True)
-
-        # DATE
-        # NOTE: zscore will be all nans if any are nans!
-        r_df["years_n"] = zscore(df[DT_COL].dt.year)
-        r_df = pd.concat(
-            [
-                r_df,
-                pd.get_dummies(df.dates.dt.hour, prefix="hour"),
-                pd.get_dummies(df.dates.dt.dayofweek, prefix="day"),
-                pd.get_dummies(df.dates.dt.month, prefix="month"),
-            ],
-            axis=1,
-        )
+        def gather_windows(batch):
+            rows = batch[:, tf.newaxis] + offsets
+            return tf.gather(features, rows), tf.gather(targets, rows)
 
-        # TEMP
-        temp_noise = df["tempc"] + np.random.normal(0, noise, df.shape[0])
-        r_df["temp_n"] = zscore(temp_noise)
-        r_df["temp_n^2"] = zscore([x * x for x in temp_noise])
+        dataset = tf.data.Dataset.from_tensor_slices(indices)
+        if shuffle:
+            dataset = dataset.shuffle(len(indices), reshuffle_each_iteration=True)
+        dataset = dataset.batch(batch_size)
+        dataset = dataset.map(gather_windows, num_parallel_calls=tf.data.AUTOTUNE)
+        return dataset.prefetch(tf.data.AUTOTUNE)
 
-        # Set the dataframe for training and testing.
-        self.all_X = self._3d_transform(r_df)
-        self.all_y = self._3d_transform(df[LOAD_COL])
+    def generate_exploded_data(self, noise=2.5):
+        """Turn a dataframe of datetime and load data into arrays useful for machine learning.
+
+        See `build_features` for the features. Set the 2D features and targets, and
+        the 3D windows of them used for training and testing.
+        """
 
-        feature_count = r_df.shape[1]
+        hours_prior = self.hours_prior
+
+        # Set the 2D data and the 3D views of it for training and testing.
+        store = self._load_feature_store()
+        if store is not None:
+            self.features = store["features"]
+            self.targets = store["targets"]
+            self.feature_columns = store["columns"]
+            self.feature_params = store["params"]
+        else:
+            self.features, self.feature_columns, self.feature_params = build_features(
+                self.df,
+                hours_prior=hours_prior,
+                noise=noise,
+                load_col=self.load_col,
+                dt_col=self.dt_col,
+                params=self.feature_params,
+                dtype=self.dtype,
+            )
+            self.targets = np.ascontiguousarray(
+                self.df[self.load_col].to_numpy(dtype=self.dtype)
+            )
+            if self.feature_store is not None:
+                save_feature_store(
+                    self.feature_store,
+                    self.features,
+                    self.targets,
+                    self.feature_columns,
+                    self.feature_params,
+                    hours_prior=hours_prior,
+                )
+        self.all_X = self._3d_transform(self.features)
+        self.all_y = self._3d_transform(self.targets)
+
+        feature_count = self.features.shape[1]
         # The important predictions of the model are those that start at the hour we care about.
         #  Because we're cutting off the input df at the model.end_date, this should be evenly
         #  divisible by 24. We need to trim first few hours of the dataframe to make sure it is
         #  evenly divisible by 24.
-        divisible_by_24_df = r_df.iloc[r_df.shape[0] % 24 :]
-        self.important_X = divisible_by_24_df.to_numpy().reshape(
-            (-1, hours_prior, feature_count)
+        self.important_X = np.ascontiguousarray(
+            self.features[self.features.shape[0] % 24 :].reshape(
+                (-1, hours_prior, feature_count)
+            )
         )
 
+    def _load_feature_store(self):
+        """Return the feature store if it exists and matches this split, else None."""
+        if self.feature_store is None:
+            return None
+        store = load_feature_store(self.feature_store)
+        if (
+            store is None
+            or store["hours_prior"] != self.hours_prior
+            or store["features"].dtype != self.dtype
+            or store["features"].shape[0] != self.df.shape[0]
+        ):
+            return None
+        if self.feature_params is not None and store["params"] != self.feature_params:
+            return None
+        return store
+
     def _3d_transform(self, data):
         """Group the data into 24-hour, 3D tests.
 
         The input dimensions are [number of tests, features] and returns dimensions [number of tests, hours_prior, features].
+        The result is a read-only view of the input, no data is copied.
         """
-        np_a = data.to_numpy()
-        return np.array(
-            [
-                np_a[i : i + self.hours_prior]
-                for i in range(np_a.shape[0] - self.hours_prior)
-                # NOTE: If you bump up against the RAM of your machine, uncomment the following line.
-                #  This'll take a fifth of the data we're creating. It's important that this number
-                #  not be divisible by 24 so that we have a diverse dataset. It's also important
-                #  to increase the number of epochs.
-                # if i % 5 == 0
-            ]
+        np_a = np.asarray(data)
+        windows = sliding_window_view(np_a, self.hours_prior, axis=0)
+        if windows.ndim == 3:
+            # Windows are added as the last axis, move them before the features
+            windows = np.moveaxis(windows, 2, 1)
+        # Drop the last window to match the previous output
+        return windows[:-1]
+
+
+# The one-hot encoded date features and their possible values
+CATEGORICAL_FEATURES = {
+    "hour": range(24),
+    "day": range(7),
+    "month": range(1, 13),
+}
+FEATURE_COLUMNS = (
+    ["load_prev_n", "years_n"]
+    + [
+        f"{name}_{value}"
+        for name, values in CATEGORICAL_FEATURES.items()
+        for value in values
+    ]
+    + ["temp_n", "temp_n^2"]
+)
+
+
+def _zscore(values, mean, std):
+    """Standardize the values, or return zeros if they don't vary."""
+    if std == 0:
+        return np.zeros_like(values)
+    return (values - mean) / std
+
+
+def build_features(
+    df,
+    hours_prior=24,
+    noise=2.5,
+    load_col="load",
+    dt_col="dates",
+    params=None,
+    dtype=np.float32,
+):
+    """Turn a dataframe of datetime, load, and temperature data into a 2D feature matrix.
+
+    Normalize values, expload categorical data, and add noise to the temperature data to simulate
+    uncertainty in a forecast. All features are written into one `dtype` array with
+    the columns of `FEATURE_COLUMNS`.
+
+    `params` are the normalization parameters (load range, and the mean and standard
+    deviation of each z-scored feature). If None they are computed from the data.
+    Return the features, their column names, and the parameters.
+    """
+
+    # TODO: Instead of shifting by hours prior, values should be explicitly grabbed by datetime.
+    # TODO: Forecast from any hour not just the first hour of the day
+    # TODO: Sort the dataframe by datetime.
+
+    n = df.shape[0]
+    dates = df[dt_col].dt
+    load = df[load_col].to_numpy(dtype=np.float64)
+    years = dates.year.to_numpy(dtype=np.float64)
+    temp = df["tempc"].to_numpy(dtype=np.float64) + np.random.normal(0, noise, n)
+    temp_squared = temp * temp
+
+    if params is None:
+        # NOTE: The load range skips nans, but the z-scores will be all nans if any are nans!
+        params = {
+            "load_range": float(np.nanmax(load) - np.nanmin(load)),
+            "years_mean": float(years.mean()),
+            "years_std": float(years.std()),
+            "temp_mean": float(temp.mean()),
+            "temp_std": float(temp.std()),
+            "temp_squared_mean": float(temp_squared.mean()),
+            "temp_squared_std": float(temp_squared.std()),
+        }
+
+    columns = {name: i for i, name in enumerate(FEATURE_COLUMNS)}
+    features = np.zeros((n, len(FEATURE_COLUMNS)), dtype=dtype)
+
+    # LOAD
+    # NOTE: This requires a sorted, continuous dataframe! Remove the current load from
+    #  the features, otherwise you're just feeding the answers into the model.
+    load_prev = np.full(n, np.nan)
+    load_prev[hours_prior:] = load[: n - hours_prior] / params["load_range"]
+    features[:, columns["load_prev_n"]] = pd.Series(load_prev).bfill().to_numpy()
+
+    # DATE
+    features[:, columns["years_n"]] = _zscore(
+        years, params["years_mean"], params["years_std"]
+    )
+    rows = np.arange(n)
+    for name, values in CATEGORICAL_FEATURES.items():
+        first_column = columns[f"{name}_{values[0]}"]
+        codes = getattr(dates, "dayofweek" if name == "day" else name).to_numpy()
+        features[rows, first_column + codes - values[0]] = 1
+
+    # TEMP
+    features[:, columns["temp_n"]] = _zscore(
+        temp, params["temp_mean"], params["temp_std"]
+    )
+    features[:, columns["temp_n^2"]] = _zscore(
+        temp_squared, params["temp_squared_mean"], params["temp_squared_std"]
+    )
+
+    return features, list(FEATURE_COLUMNS), params
+
+
+FEATURE_STORE_FILES = {
+    "features": "features.npy",
+    "targets": "targets.npy",
+    "metadata": "metadata.json",
+}
+# The windows a model was trained and scored on, see `DataSplit.save_split`
+SPLIT_FILENAME = "split.npz"
+
+
+def save_feature_store(path, features, targets, columns, params, hours_prior=24):
+    """Save the features and targets as .npy files, with their metadata, to the `path` directory."""
+    os.makedirs(path, exist_ok=True)
+    # A stored split was of the previous features
+    if os.path.exists(os.path.join(path, SPLIT_FILENAME)):
+        os.remove(os.path.join(path, SPLIT_FILENAME))
+    np.save(os.path.join(path, FEATURE_STORE_FILES["features"]), features)
+    np.save(os.path.join(path, FEATURE_STORE_FILES["targets"]), targets)
+    # NOTE: The metadata is written last, so an incomplete store is never loaded
+    with open(os.path.join(path, FEATURE_STORE_FILES["metadata"]), "w") as f:
+        json.dump({"columns": columns, "params": params, "hours_prior": hours_prior}, f)
+
+
+def load_feature_store(path, mmap_mode="r"):
+    """Return the features, targets and metadata saved by `save_feature_store`, or None.
+
+    The arrays are memory mapped (read-only by default), so loading is instant and
+    processes reading the same store share its pages.
+    """
+    metadata_path = os.path.join(path, FEATURE_STORE_FILES["metadata"])
+    if not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path, "r") as f:
+        store = json.load(f)
+    for name in ["features", "targets"]:
+        store[name] = np.load(
+            os.path.join(path, FEATURE_STORE_FILES[name]), mmap_mode=mmap_mode
         )
+    return store
 
 
-def train_and_test_model(ds: DataSplit, epochs=20, save_file=None, tensorboard=False):
-    """Train a neural net and forecast the next day's load."""
-    HOURS_AHEAD = 24
+def save_split_indices(path, train_indices, test_indices):
+    """Save the training and testing window indices with the features at `path`."""
+    np.savez(os.path.join(path, SPLIT_FILENAME), train=train_indices, test=test_indices)
+
+
+def load_split_indices(path):
+    """Return the training and testing window indices saved by `save_split_indices`, or None."""
+    split_path = os.path.join(path, SPLIT_FILENAME)
+    if not os.path.exists(split_path):
+        return None
+    with np.load(split_path) as split:
+        return split["train"], split["test"]
+
+
+class WindowSequence(tf.keras.utils.Sequence):
+    """Feed the selected windows of a DataSplit to keras batch by batch.
+
+    Only the windows of the current batch are copied out of the (view) arrays.
+    """
+
+    def __init__(self, X, y, indices, batch_size=32, shuffle=True):
+        self.X = X
+        self.y = y
+        self.indices = np.array(indices)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        if self.shuffle:
+            np.random.shuffle(self.indices)
+
+    def __len__(self):
+        return int(np.ceil(len(self.indices) / self.batch_size))
+
+    def __getitem__(self, i):
+        batch = self.indices[i * self.batch_size : (i + 1) * self.batch_size]
+        return self.X[batch], self.y[batch]
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.indices)
+
 
+def build_model(feature_count):
+    """Return the compiled neural net for `feature_count` features per hour."""
+    HOURS_AHEAD = 24
     model = tf.keras.Sequential(
         [
             layers.Dense(
-                ds.train_X.shape[2],
+                feature_count,
                 activation=tf.nn.relu,
-                input_shape=(HOURS_AHEAD, ds.train_X.shape[2]),
+                input_shape=(HOURS_AHEAD, feature_count),
             ),
-            layers.Dense(ds.train_X.shape[2], activation=tf.nn.relu),
-            layers.Dense(ds.train_X.shape[2], activation=tf.nn.relu),
-            layers.Dense(ds.train_X.shape[2], activation=tf.nn.relu),
-            layers.Dense(ds.train_X.shape[2], activation=tf.nn.relu),
+            layers.Dense(feature_count, activation=tf.nn.relu),
+            layers.Dense(feature_count, activation=tf.nn.relu),
+            layers.Dense(feature_count, activation=tf.nn.relu),
+            layers.Dense(feature_count, activation=tf.nn.relu),
             layers.Flatten(),
-            layers.Dense(ds.train_X.shape[2] * HOURS_AHEAD, activation=tf.nn.relu),
-            layers.Dense(ds.train_X.shape[2] * HOURS_AHEAD // 2, activation=tf.nn.relu),
-            layers.Dense(ds.train_X.shape[2] * HOURS_AHEAD // 4, activation=tf.nn.relu),
+            layers.Dense(feature_count * HOURS_AHEAD, activation=tf.nn.relu),
+            layers.Dense(feature_count * HOURS_AHEAD // 2, activation=tf.nn.relu),
+            layers.Dense(feature_count * HOURS_AHEAD // 4, activation=tf.nn.relu),
             layers.Dense(HOURS_AHEAD),
         ]
     )
 
-    log_dir = "tb-logs/" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-
     nadam = tf.keras.optimizers.Nadam(learning_rate=0.002, beta_1=0.9, beta_2=0.999)
     model.compile(optimizer=nadam, loss="mape")
+    return model
+
+
+def train_and_test_model(
+    ds: DataSplit,
+    epochs=20,
+    save_file=None,
+    tensorboard=False,
+    streaming=False,
+    model=None,
+    train_indices=None,
+    test_indices=None,
+):
+    """Train a neural net and forecast the next day's load.
+
+    If `streaming` is True, feed the model through a tf.data pipeline (see
+    `DataSplit.dataset`) rather than batches copied on the main thread.
+
+    To warm start, pass a trained `model` to fine-tune instead of building a new one,
+    and the `train_indices` to fit it on and `test_indices` to score it on (see
+    `DataSplit.warm_start_split`). By default the split's own windows are used.
+    """
+    batches = ds.dataset if streaming else ds.sequence
+
+    if model is None:
+        model = build_model(ds.feature_count)
+    if train_indices is None:
+        train_indices = ds.train_indices
+    if test_indices is None:
+        test_indices = ds.test_indices
+
+    log_dir = "tb-logs/" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
 
     model_callbacks = [
         callbacks.TerminateOnNaN(),
@@ -156,18 +509,286 @@ def train_and_test_model(ds: DataSplit, epochs=20, save_file=None, tensorboard=F
         )
 
     model.fit(
-        ds.train_X,
-        ds.train_y,
+        batches(train_indices, shuffle=True),
         epochs=epochs,
         callbacks=model_callbacks,
     )
 
     accuracy = {
-        "train": model.evaluate(ds.train_X, ds.train_y, verbose=0),
-        "test": model.evaluate(ds.test_X, ds.test_y, verbose=0),
+        "train": model.evaluate(batches(train_indices, shuffle=False), verbose=0),
+        "test": model.evaluate(batches(test_indices, shuffle=False), verbose=0),
+    }
+
+    if save_file is not None:
+        model.save(save_file)
+
+    return model, accuracy
+
+
+def cpu_shares(processes):
+    """Split the CPUs this process may run on into `processes` disjoint lists."""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count()))
+    processes = min(processes, len(cpus))
+    return [share.tolist() for share in np.array_split(cpus, processes)]
+
+
+def _pin_worker(shares):
+    """Pin a pool process to its own share of the CPUs, see `pinned_pool`."""
+    cpus = shares.get()
+    # NOTE: Affinity can't be set on macOS, limiting tensorflow's threads still helps
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    tf.config.threading.set_intra_op_parallelism_threads(len(cpus))
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def pinned_pool(processes):
+    """Return a pool of up to `processes` processes, each pinned to its own share of the CPUs."""
+    # NOTE: Forking a process that has used tensorflow isn't safe
+    context = multiprocessing.get_context("spawn")
+    cpus = cpu_shares(processes)
+    shares = context.Queue()
+    for share in cpus:
+        shares.put(share)
+    return context.Pool(len(cpus), initializer=_pin_worker, initargs=(shares,))
+
+
+def _split_kwargs(ds):
+    """Return the arguments to rebuild a DataSplit in another process from its feature store."""
+    if ds.feature_store is None:
+        raise Exception("Pool processes read their features from a feature store.")
+    return {
+        "df": ds.df,
+        "hours_prior": ds.hours_prior,
+        "load_col": ds.load_col,
+        "dt_col": ds.dt_col,
+        "feature_params": ds.feature_params,
+        "dtype": ds.dtype,
+        "feature_store": ds.feature_store,
+    }
+
+
+def _train_ensemble_member(kwargs):
+    """Train one member of an ensemble in a pool process and return its accuracy.
+
+    The features are memory mapped from the feature store rather than copied
+    into every process, and the split is the parent's so all members share it.
+    """
+    train_indices = kwargs.pop("train_indices")
+    test_indices = kwargs.pop("test_indices")
+    epochs = kwargs.pop("epochs")
+    save_file = kwargs.pop("save_file")
+    streaming = kwargs.pop("streaming")
+
+    ds = DataSplit(**kwargs)
+    ds.train_indices, ds.test_indices = train_indices, test_indices
+    _, accuracy = train_and_test_model(
+        ds, epochs=epochs, save_file=save_file, streaming=streaming
+    )
+    return accuracy
+
+
+def build_ensemble(members):
+    """Return a compiled model whose forecast is the mean of the `members`' forecasts."""
+    inputs = tf.keras.Input(shape=members[0].input_shape[1:])
+    for i, member in enumerate(members):
+        # NOTE: Members loaded from files have the same name, which keras rejects
+        member._name = f"member_{i}"
+    outputs = layers.Average()([member(inputs) for member in members])
+    model = tf.keras.Model(inputs, outputs)
+
+    nadam = tf.keras.optimizers.Nadam(learning_rate=0.002, beta_1=0.9, beta_2=0.999)
+    model.compile(optimizer=nadam, loss="mape")
+    return model
+
+
+def ensemble_members(model):
+    """Return the members of a model built by `build_ensemble`, or [] for a single model."""
+    return [layer for layer in model.layers if isinstance(layer, tf.keras.Model)]
+
+
+def predict_with_spread(model, X):
+    """Return the forecasts of a model, and their lowest and highest member forecasts.
+
+    A single model has no spread, so its bounds are None.
+    """
+    members = ensemble_members(model)
+    if not members:
+        return model.predict(X).flatten(), None, None
+
+    predictions = np.stack([member.predict(X).flatten() for member in members])
+    return predictions.mean(axis=0), predictions.min(axis=0), predictions.max(axis=0)
+
+
+def train_ensemble(
+    ds: DataSplit,
+    save_files,
+    epochs=20,
+    save_file=None,
+    processes=None,
+    streaming=False,
+):
+    """Train one neural net per file in `save_files` and return their mean as one model.
+
+    The members are trained concurrently in a pool of `processes` (as many as
+    there are members by default), each pinned to its own share of the CPUs.
+    With one process they are trained one after the other in this process.
+    Otherwise the split must have a `feature_store`, which the processes read from.
+
+    The accuracy of the mean is returned along with the accuracy of each member.
+    """
+    processes = min(processes or len(save_files), len(save_files))
+
+    if processes == 1:
+        member_accuracies = [
+            train_and_test_model(
+                ds, epochs=epochs, save_file=member_file, streaming=streaming
+            )[1]
+            for member_file in save_files
+        ]
+    else:
+        member_kwargs = [
+            {
+                **_split_kwargs(ds),
+                "train_indices": ds.train_indices,
+                "test_indices": ds.test_indices,
+                "epochs": epochs,
+                "save_file": member_file,
+                "streaming": streaming,
+            }
+            for member_file in save_files
+        ]
+        with pinned_pool(processes) as pool:
+            member_accuracies = pool.map(_train_ensemble_member, member_kwargs, 1)
+
+    model = build_ensemble(
+        [tf.keras.models.load_model(member_file) for member_file in save_files]
+    )
+    batches = ds.dataset if streaming else ds.sequence
+    accuracy = {
+        "train": model.evaluate(batches("train", shuffle=False), verbose=0),
+        "test": model.evaluate(batches("test"), verbose=0),
+        "members": member_accuracies,
     }
 
     if save_file is not None:
         model.save(save_file)
 
     return model, accuracy
+
+
+def backtest_origins(ds, days=30):
+    """Return the windows that forecast each of the last `days` days with load data.
+
+    A window forecasts the load of its own hours, and the windows of the days start
+    where `important_X` does, see `generate_exploded_data`.
+    """
+    HOURS_AHEAD = 24
+    if days <= 0:
+        return np.array([], dtype=int)
+    starts = np.arange(
+        ds.targets.shape[0] % HOURS_AHEAD, ds.all_X.shape[0], HOURS_AHEAD
+    )
+    has_load = ~np.isnan(ds.all_y[starts]).any(axis=1)
+    return starts[has_load][-days:]
+
+
+def _backtest_origin(kwargs):
+    """Train a model on the windows before an origin in a pool process and return its forecast."""
+    origin = kwargs.pop("origin")
+    epochs = kwargs.pop("epochs")
+    streaming = kwargs.pop("streaming")
+
+    ds = DataSplit(**kwargs)
+    batches = ds.dataset if streaming else ds.sequence
+    model = build_model(ds.feature_count)
+    # Only windows that end before the origin are known when forecasting it
+    model.fit(
+        batches(np.arange(origin - ds.hours_prior + 1), shuffle=True),
+        epochs=epochs,
+        callbacks=[
+            callbacks.TerminateOnNaN(),
+            callbacks.EarlyStopping(monitor="loss", patience=3),
+        ],
+        verbose=0,
+    )
+    return model.predict(ds.all_X[[origin]], verbose=0)[0]
+
+
+def backtest(
+    ds: DataSplit, origins, model=None, epochs=0, processes=None, streaming=False
+):
+    """Forecast the day of each window in `origins` and return the percentage errors.
+
+    With a trained `model` and no `epochs` its forecasts are replayed without any
+    training, in one batch. Its errors are optimistic on the days it was trained on,
+    which are flagged as `trained_on`: those that share an hour with any of the
+    split's training windows. The split must be the model's, see
+    `DataSplit.save_split`. Otherwise a new model is trained for each origin, for
+    `epochs`, on the windows before it. These are trained in a pool of `processes`
+    (see `pinned_pool`), so the split must have a `feature_store`.
+
+    Return a dataframe of the absolute percentage error of each hour ahead, indexed
+    by the origins' dates. Errors of hours without load are NaN. See
+    `backtest_tables` to summarize it.
+    """
+    origins = np.asarray(origins, dtype=int)
+    if len(origins) == 0:
+        predictions = np.empty((0, ds.hours_prior), dtype=ds.dtype)
+    elif epochs == 0:
+        if model is None:
+            raise Exception("A model is required to backtest without training.")
+        predictions = model.predict(ds.all_X[origins], verbose=0)
+    else:
+        origin_kwargs = [
+            {
+                **_split_kwargs(ds),
+                "origin": origin,
+                "epochs": epochs,
+                "streaming": streaming,
+            }
+            for origin in origins
+        ]
+        with pinned_pool(processes or len(origins)) as pool:
+            predictions = np.stack(pool.map(_backtest_origin, origin_kwargs, 1))
+
+    actual = ds.all_y[origins]
+    # NOTE: A percentage error of no load is undefined
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percentage_errors = np.abs(predictions - actual) / np.abs(actual) * 100
+    percentage_errors[actual == 0] = np.nan
+    errors = pd.DataFrame(
+        percentage_errors.astype(np.float32),
+        index=pd.DatetimeIndex(ds.df[ds.dt_col].to_numpy()[origins], name="origin"),
+        columns=[f"hour_{hour}" for hour in range(actual.shape[1])],
+    )
+    trained_on = np.zeros(len(origins), dtype=bool)
+    if epochs == 0:
+        # NOTE: Windows less than a window apart share target hours, so the model
+        #  was fit on some of a day's hours by any training window that close to it
+        train_indices = np.sort(ds.train_indices)
+        first = np.searchsorted(train_indices, origins - ds.hours_prior + 1)
+        last = np.searchsorted(train_indices, origins + ds.hours_prior - 1, "right")
+        trained_on = last > first
+    errors["trained_on"] = trained_on
+    return errors
+
+
+def backtest_tables(errors):
+    """Return the mean and max percentage error of each day, and the mean of each hour ahead, of a `backtest`."""
+    hourly = errors.drop(columns="trained_on")
+    by_day = pd.DataFrame(
+        {
+            "mape": hourly.mean(axis=1),
+            "max_ape": hourly.max(axis=1),
+            "trained_on": errors["trained_on"],
+        }
+    )
+    by_hour = pd.DataFrame(
+        {"mape": hourly.mean(axis=0).to_numpy()},
+        index=pd.RangeIndex(hourly.shape[1], name="hour"),
+    )
+    return by_day, by_hour
@@ -1,19 +1,47 @@
 """A collection of ORMs for the forecast_app, configured with sqlalchemy."""
 
 import datetime
+import json
+import math
+import multiprocessing
 import os
 import shutil
 import signal
+import threading
+import time
+import uuid
+from multiprocessing import active_children
 
 import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 import tensorflow as tf
 from flask import current_app
-from sqlalchemy import JSON, Column, DateTime, Float, Integer, String
+from sqlalchemy import (
+    JSON,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    func,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.orm import deferred, relationship
 
 import forecast_app.forecast as lf
+from forecast_app import burtcoppd
+from forecast_app.serving import model_cache
 from forecast_app.utils import db, safe_flash
 
+# NOTE: Forking a process that has used tensorflow isn't safe, e.g. the web app
+#  after it served predictions, so workers are spawned
+spawn = multiprocessing.get_context("spawn")
+
 
 class ForecastModel(db.Model):
     """A database model that stores information about a deep learning model"""
@@ -21,22 +49,43 @@ class ForecastModel(db.Model):
     __tablename__ = "forecast_model"
     creation_date = Column(DateTime, primary_key=True)
     slug = Column(String, unique=True, nullable=False)
-    milliseconds = Column(JSON, nullable=False)  # TODO: This should be a property
+    # NOTE: The JSON columns are large, so only load them when they're accessed
+    milliseconds = deferred(
+        Column(JSON, nullable=False), group="json"
+    )  # TODO: This should be a property
     # TODO: This is start_dt and end_dt
     start_date = Column(DateTime, nullable=False)
     end_date = Column(DateTime, nullable=False)
-    tempcs = Column(JSON, nullable=False)  # TODO: Remove me, this is tracked in the df
+    tempcs = deferred(
+        Column(JSON, nullable=False), group="json"
+    )  # TODO: Remove me, this is tracked in the df
     model_file = Column(String, nullable=False)  # TODO: Remove me
+    # NOTE: Only models trained before `TrainingJob` stored their status in this file
     process_file = Column(String, nullable=False)  # TODO: Remove me
     output_dir = Column(String, nullable=False)
-    accuracy = Column(JSON)
-    loads = Column(JSON)  # TODO: Remove me, this is tracked in the df
+    accuracy = deferred(Column(JSON), group="json")
+    loads = deferred(
+        Column(JSON), group="json"
+    )  # TODO: Remove me, this is tracked in the df
     epochs = Column(Integer, nullable=False)
-
-    df_filename = "cached-dataframe.csv"
+    job = relationship(
+        "TrainingJob",
+        uselist=False,
+        back_populates="model",
+        cascade="all, delete-orphan",
+    )
+
+    df_filename = "cached-dataframe.parquet"
+    # NOTE: Models created before parquet storage only have a CSV. It's still the
+    #  format offered for download.
+    csv_df_filename = "cached-dataframe.csv"
+    feature_store_dirname = "feature-store"
+    detail_payload_filename = "detail-payload.json"
+    backtest_filename = "backtest.parquet"
 
     # Status messages
     NOT_STARTED = "NOT STARTED"
+    QUEUED = "QUEUED"
     RUNNING = "RUNNING"
     COMPLETED_SUCCESSFULLY = "COMPLETED"
     FAILURE = "FAILURE"
@@ -48,7 +97,7 @@ class ForecastModel(db.Model):
            collecting a dataframe can take a few seconds, this is useful for pushing
            this logic to a subprocess when loading a web page. If this option is used,
            `collect_training_data` and `store_df` must be called manually or use
-           `launch_subprocess`.
+           `train`, e.g. by queueing a `TrainingJob`.
         """
 
         # NOTE: Object is initialized from state of the database
@@ -62,6 +111,12 @@ class ForecastModel(db.Model):
         self.creation_date = datetime.datetime.now()
         self.slug = self.creation_date.strftime("%Y-%m-%d.%H-%M-%S")
         self.output_dir = os.path.join(current_app.config["OUTPUT_DIR"], self.slug)
+        # Models created within the same second would otherwise share a slug
+        base_slug, suffix = self.slug, 1
+        while os.path.exists(self.output_dir):
+            suffix += 1
+            self.slug = f"{base_slug}-{suffix}"
+            self.output_dir = os.path.join(current_app.config["OUTPUT_DIR"], self.slug)
         os.makedirs(self.output_dir)
 
         # TODO: This should be named path or rewrite this
@@ -69,8 +124,10 @@ class ForecastModel(db.Model):
         self.model_file = os.path.join(self.output_dir, self.model_filename)
         self.process_file = os.path.join(self.output_dir, "PID.txt")
 
+        # NOTE: Read through the cached dataframe, and store nulls rather than NaNs
+        tempcs = ForecastWeatherData.to_df()[ForecastWeatherData.column_name]
         self.tempcs = [
-            row.value for row in ForecastWeatherData.query.all()
+            None if math.isnan(value) else value for value in tempcs.tolist()
         ]  # Ensure length is appropriate
         # NOTE: Cannot JSON serialize datetime objects
         # TODO: This should span start_date to end_date
@@ -92,46 +149,76 @@ class ForecastModel(db.Model):
 
     @property
     def status(self):
-        """Return the status of the model."""
-        pid = self.get_process_id()
-        if pid is None:
+        """Return the status of the model's training job.
+
+        A running job whose worker stopped sending heartbeats has failed.
+        """
+        if self.job is None:
+            return self.get_legacy_status()
+        if self.job.state == self.RUNNING and not self.job.is_alive:
+            return self.FAILURE
+        return self.job.state
+
+    def get_legacy_status(self):
+        """Return the status of a model trained before `TrainingJob`, from its process file."""
+        if not os.path.exists(self.process_file):
             return self.NOT_STARTED
-        elif pid in [self.COMPLETED_SUCCESSFULLY, self.FAILURE]:
-            return pid
-        # If pid is a number, it is a running process
-        return self.RUNNING
+        with open(self.process_file, "r") as f:
+            status = f.read()
+        # A process id can't be tracked anymore
+        return status if status == self.COMPLETED_SUCCESSFULLY else self.FAILURE
 
     @property
     def is_running(self):
         """Return True if the model is currently running."""
         return self.status == self.RUNNING
 
+    @property
+    def is_queued(self):
+        """Return True if the model is waiting for a training worker, see `TrainingJob`."""
+        return self.status == self.QUEUED
+
     @property
     def exited_successfully(self):
         """Return True if the model exited successfully."""
         return self.status == self.COMPLETED_SUCCESSFULLY
 
-    def store_process_id(self, process_id):
-        """Store the process id of the model in a text file to help with multiprocessing."""
-
-        with open(self.process_file, "w") as f:
-            f.write(str(process_id))
+    def store_status(self, status, pid=None, reason=None):
+        """Store the status of the model's training job. WARNING: The model is saved too.
 
-    def get_process_id(self):
-        """Extract the process id from the process file to help with multiprocessing. Return None if not found."""
-
-        if os.path.exists(self.process_file):
-            with open(self.process_file, "r") as f:
-                return f.read()
-        return None
+        `pid` is the id of the process training a RUNNING model, and `reason`
+        explains why a model exited.
+        """
+        now = datetime.datetime.now()
+        if self.job is None:
+            self.job = TrainingJob(queued_at=now)
+        self.job.state = status
+        if status == self.RUNNING:
+            self.job.pid = pid
+            self.job.started_at = now
+            self.job.heartbeat = now
+        elif status in [self.COMPLETED_SUCCESSFULLY, self.FAILURE]:
+            self.job.ended_at = now
+            self.job.exit_reason = reason
+        if status == self.COMPLETED_SUCCESSFULLY:
+            LatestModel.update(self)
+        self.save()
 
     def cancel(self):
-        """Cancel the model's training if it is running. If it isn't running, raise an exception."""
+        """Cancel the model's training if it is running or queued. Otherwise, raise an exception."""
 
-        pid = self.get_process_id()
         if self.is_running:
-            os.kill(int(pid), signal.SIGKILL)
-            self.store_process_id(self.FAILURE)
+            try:
+                os.kill(self.job.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            # NOTE: The killed worker can't release its slot itself
+            TrainingWorker.query.filter_by(pid=self.job.pid).delete()
+            # Reap the worker if this process started it
+            active_children()
+            self.store_status(self.FAILURE, reason="Cancelled")
+        elif self.is_queued:
+            self.store_status(self.FAILURE, reason="Cancelled")
         else:
             raise Exception("Model is not running.")
 
@@ -146,35 +233,27 @@ class ForecastModel(db.Model):
         # Delete the output directory
         if os.path.exists(self.output_dir):
             shutil.rmtree(self.output_dir)
+        model_cache.evict(self.slug)
 
-        # Delete the database entry
+        # Delete the database entry, its job, and the pointer to it
+        LatestModel.query.filter_by(slug=self.slug).delete()
         db.session.delete(self)
         db.session.commit()
 
     def __repr__(self):
         return f"<ForecastModel {self.creation_date}>"
 
-    def launch_subprocess(self, app_config):
-        """Launch the model's training in a separate process."""
-        # HACK: Because this is launched in another thread, we need to
-        #       recreate the app context (!) Please think of a better way
-        #       to do this.
-        # https://www.reddit.com/r/flask/comments/5jrrsu/af_appapp_context_in_thread_throws_working/
-        from forecast_app import create_app
-
-        app = create_app(app_config)
-        app.app_context().push()
-
-        df = self.collect_training_data()
-        self.store_df(df)
-
+    def train(self):
+        """Collect the training data, train the model, and store whether it succeeded."""
         try:
+            df = self.collect_training_data()
+            self.store_df(df)
             print("Executing forecast...")
             self.execute_forecast()
             print("Finished with forecast...")
-            self.store_process_id(self.COMPLETED_SUCCESSFULLY)
+            self.store_status(self.COMPLETED_SUCCESSFULLY)
         except Exception as e:
-            self.store_process_id(self.FAILURE)
+            self.store_status(self.FAILURE, reason=str(e))
             raise Exception(f"Model failed: {e}")
 
     def collect_training_data(self):
@@ -198,10 +277,7 @@ class ForecastModel(db.Model):
         df_h["load"] = df_h["load"].interpolate(limit_direction="both")
         df_h["tempc"] = df_h["tempc"].interpolate(limit_direction="both")
 
-        df_f = ForecastWeatherData.to_df().sort_values("dates")
-        df_f = df_f[
-            (self.start_date <= df_f["dates"]) & (df_f["dates"] <= self.end_date)
-        ]
+        df_f = ForecastWeatherData.to_df(start=self.start_date, end=self.end_date)
         df_f["tempc"] = df_f["tempc"].interpolate(limit_direction="both")
 
         # TODO: Allow for different sized days
@@ -220,14 +296,54 @@ class ForecastModel(db.Model):
         """Path to the key dataframe used for training."""
         return os.path.join(self.output_dir, self.df_filename)
 
-    def store_df(self, df):
-        """Store the dataframe in the output directory."""
-        df.to_csv(self.df_path, index=False)
+    @property
+    def feature_store_path(self):
+        """Path to the features built from the dataframe, see `lf.save_feature_store`."""
+        return os.path.join(self.output_dir, self.feature_store_dirname)
+
+    @property
+    def ensemble_member_files(self):
+        """Paths to the members of the model if it's trained as an ensemble, see `lf.train_ensemble`."""
+        return [
+            os.path.join(self.output_dir, f"ensemble-member-{i}.h5")
+            for i in range(current_app.config["ENSEMBLE_MEMBERS"])
+        ]
+
+    @property
+    def csv_df_path(self):
+        """Path to the dataframe of models stored as CSV."""
+        return os.path.join(self.output_dir, self.csv_df_filename)
+
+    def store_df(self, df, keep_feature_store=False):
+        """Store the dataframe in the output directory as parquet.
 
-    def get_df(self):
-        """Return the dataframe used for training."""
+        Unless `keep_feature_store` is True, the stored features are removed because
+        they were built from the previous dataframe.
+        """
+        df = df.assign(dates=pd.to_datetime(df["dates"]))
+        df.to_parquet(self.df_path, index=False)
+        # Don't fall back to an outdated CSV
+        if os.path.exists(self.csv_df_path):
+            os.remove(self.csv_df_path)
+        if not keep_feature_store and os.path.exists(self.feature_store_path):
+            shutil.rmtree(self.feature_store_path)
+        # The detail page is computed from the dataframe
+        if os.path.exists(self.detail_payload_path):
+            os.remove(self.detail_payload_path)
+
+    def get_df(self, columns=None):
+        """Return the dataframe used for training, or None if it hasn't been stored.
+
+        If `columns` is given only those columns that exist are read.
+        """
         if os.path.exists(self.df_path):
-            return pd.read_csv(self.df_path, parse_dates=["dates"])
+            if columns is not None:
+                names = pq.read_schema(self.df_path).names
+                columns = [column for column in columns if column in names]
+            return pd.read_parquet(self.df_path, columns=columns)
+        if os.path.exists(self.csv_df_path):
+            usecols = None if columns is None else (lambda column: column in columns)
+            return pd.read_csv(self.csv_df_path, usecols=usecols, parse_dates=["dates"])
         return None
 
     def get_model(self):
@@ -236,20 +352,44 @@ class ForecastModel(db.Model):
             return tf.keras.models.load_model(self.model_file)
         return None
 
+    def predict(self, X):
+        """Return the model's predictions for the windows `X`, served from the model cache."""
+        return model_cache.predict(self, X)
+
+    def get_data_split(self):
+        """Return the DataSplit of the dataframe, memory mapping the stored features if they exist."""
+        return lf.DataSplit(
+            self.get_df(),
+            hours_prior=current_app.config["HOURS_PRIOR"],
+            feature_store=self.feature_store_path,
+        )
+
     def store_prediction_data(self, model, data_split):
-        """Store the prediction data in the model's dataframe."""
+        """Store the prediction data in the model's dataframe.
+
+        The forecast of an ensemble is the mean of its members, and the lowest and
+        highest member forecasts are stored as the bounds of its spread.
+        """
         INT_PLACEHOLDER = -9999
         df = data_split.df
-        predictions = model.predict(data_split.important_X).flatten()
-
-        # Pad the predictions with -9999 to match the length of the dataframe and then replace with NaNs
-        padded_predictions = np.insert(
-            predictions, 0, [INT_PLACEHOLDER] * (df.shape[0] % 24)
+        predictions, lower, upper = lf.predict_with_spread(
+            model, data_split.important_X
         )
-        df["forecasted_load"] = padded_predictions
-        df["forecasted_load"] = df["forecasted_load"].replace(INT_PLACEHOLDER, np.nan)
 
-        self.store_df(df)
+        # Pad the predictions with -9999 to match the length of the dataframe and then replace with NaNs
+        for column, values in [
+            ("forecasted_load", predictions),
+            ("forecasted_load_lower", lower),
+            ("forecasted_load_upper", upper),
+        ]:
+            if values is None:
+                continue
+            padded_values = np.insert(values, 0, [INT_PLACEHOLDER] * (df.shape[0] % 24))
+            df[column] = padded_values
+            df[column] = df[column].replace(INT_PLACEHOLDER, np.nan)
+
+        # NOTE: Only predictions were added, the features are still valid
+        self.store_df(df, keep_feature_store=True)
 
     def execute_forecast(self):
         """Execute the forecast (outside a thread.) And save all info after finishing.
@@ -259,16 +399,343 @@ class ForecastModel(db.Model):
         into training and testing sets, and train the model. Store all pertinent
         information in the database.
         """
-        data_split = lf.DataSplit(
-            self.get_df(), hours_prior=current_app.config["HOURS_PRIOR"]
+        warm_start = self.get_warm_start() if current_app.config["WARM_START"] else None
+        if warm_start is None and current_app.config["ENSEMBLE_MEMBERS"] > 1:
+            data_split = self.get_data_split()
+            model, self.accuracy = lf.train_ensemble(
+                data_split,
+                self.ensemble_member_files,
+                epochs=self.epochs,
+                save_file=self.model_file,
+                processes=current_app.config["ENSEMBLE_PROCESSES"],
+                streaming=current_app.config["STREAMING_TRAINING"],
+            )
+            data_split.save_split()
+        elif warm_start is None:
+            data_split = self.get_data_split()
+            model, self.accuracy = lf.train_and_test_model(
+                data_split,
+                epochs=self.epochs,
+                save_file=self.model_file,
+                tensorboard=False,
+                streaming=current_app.config["STREAMING_TRAINING"],
+            )
+            data_split.save_split()
+        else:
+            previous, model, feature_params = warm_start
+            print(f"Warm starting from {previous.slug}...")
+            # NOTE: The features must be normalized like the previous model's
+            data_split = lf.DataSplit(
+                self.get_df(),
+                hours_prior=current_app.config["HOURS_PRIOR"],
+                feature_params=feature_params,
+                feature_store=self.feature_store_path,
+            )
+            # NOTE: Only windows the previous model never saw are used to score it
+            train_indices, test_indices = data_split.warm_start_split(
+                previous.start_date, replay=current_app.config["WARM_START_REPLAY"]
+            )
+            self.epochs = current_app.config["WARM_START_EPOCHS"]
+            model, self.accuracy = lf.train_and_test_model(
+                data_split,
+                epochs=self.epochs,
+                save_file=self.model_file,
+                tensorboard=False,
+                streaming=current_app.config["STREAMING_TRAINING"],
+                model=model,
+                train_indices=train_indices,
+                test_indices=test_indices,
+            )
+            # NOTE: The previous models may have been trained on any earlier window
+            data_split.save_split(
+                np.union1d(
+                    train_indices, data_split.windows_before(previous.start_date)
+                ),
+                test_indices,
+            )
+
+        self.store_prediction_data(model, data_split)
+        self.save()
+        self.store_detail_payload()
+
+    @property
+    def detail_payload_path(self):
+        """Path to the precomputed data of the model's detail page."""
+        return os.path.join(self.output_dir, self.detail_payload_filename)
+
+    @staticmethod
+    def _chart_data(df, column):
+        """Return [timestamp, value] pairs of a column for Highcharts, with NaNs as None."""
+        return [
+            [timestamp, None if math.isnan(value) else value]
+            for timestamp, value in zip(
+                df["timestamp"].tolist(), df[column].astype(float).tolist()
+            )
+        ]
+
+    def get_training_chart(self, df):
+        """Return the load and forecast series of the whole dataframe."""
+        if df is None or ("forecasted_load" not in df.columns):
+            return None
+
+        return [
+            {
+                "data": self._chart_data(df, "load"),
+                "name": "Load",
+            },
+            {
+                "data": self._chart_data(df, "forecasted_load"),
+                "name": "Forecast",
+                "color": "blue",
+            },
+        ]
+
+    def get_forecast_chart(self, df):
+        """Return the forecast series with a few days of load data for context."""
+        if df is None or ("forecasted_load" not in df.columns):
+            return None
+
+        # Get end of load data
+        lvi = df["load"].last_valid_index()
+        CONTEXT = 72
+        chart = [
+            {
+                "data": self._chart_data(df.iloc[lvi - CONTEXT : lvi], "load"),
+                "name": "Load",
+            },
+            {
+                # lvi - 1 because it's nicer to see the chart connected to historical data
+                "data": self._chart_data(df.iloc[lvi - 1 :], "forecasted_load"),
+                "name": "Forecast",
+                "color": "blue",
+            },
+        ]
+        if "forecasted_load_lower" in df.columns:
+            # NOTE: Drawn as lines, highstock doesn't include the arearange series
+            for bound in ["lower", "upper"]:
+                chart.append(
+                    {
+                        "data": self._chart_data(
+                            df.iloc[lvi - 1 :], f"forecasted_load_{bound}"
+                        ),
+                        "name": f"Ensemble {bound} bound",
+                        "color": "blue",
+                        "dashStyle": "ShortDash",
+                        "lineWidth": 1,
+                    }
+                )
+        return chart
+
+    def compute_detail_payload(self):
+        """Return the charts, peak info and accuracy shown on the model's detail page."""
+        df = self.get_df(
+            columns=[
+                "dates",
+                "load",
+                "forecasted_load",
+                "forecasted_load_lower",
+                "forecasted_load_upper",
+            ]
         )
+        if df is not None:
+            df = df.sort_values("dates", ignore_index=True)
+            df["timestamp"] = df.dates.astype("int64") / 10**6
+
+        peak_info = burtcoppd.get_on_and_off_peak_info(df, self)
+        if peak_info:
+            # NOTE: Store JSON serializable values, see `get_detail_payload`
+            peak_info = {
+                peak: {
+                    "max_load": float(info["max_load"]),
+                    "timestamp": info["timestamp"].isoformat(),
+                }
+                for peak, info in peak_info.items()
+            }
+
+        return {
+            "forecast_chart": self.get_forecast_chart(df),
+            "training_chart": self.get_training_chart(df),
+            "peak_info": peak_info,
+            "accuracy": self.accuracy,
+        }
 
-        model, self.accuracy = lf.train_and_test_model(
-            data_split, epochs=self.epochs, save_file=self.model_file, tensorboard=False
+    def store_detail_payload(self):
+        """Compute the detail page data and store it in the output directory."""
+        payload = self.compute_detail_payload()
+        with open(self.detail_payload_path, "w") as f:
+            json.dump(payload, f)
+        return payload
+
+    def get_detail_payload(self):
+        """Return the detail page data, computing it if it hasn't been stored.
+
+        A completed model doesn't change, so its data is stored when it's missing, for
+        example for models trained before the data was precomputed.
+        """
+        if os.path.exists(self.detail_payload_path):
+            with open(self.detail_payload_path, "r") as f:
+                payload = json.load(f)
+        elif self.exited_successfully:
+            payload = self.store_detail_payload()
+        else:
+            payload = self.compute_detail_payload()
+
+        if payload["peak_info"]:
+            for info in payload["peak_info"].values():
+                info["timestamp"] = datetime.datetime.fromisoformat(info["timestamp"])
+        return payload
+
+    @property
+    def backtest_path(self):
+        """Path to the errors of the model's latest backtest, see `backtest`."""
+        return os.path.join(self.output_dir, self.backtest_filename)
+
+    def backtest(self, days=None, epochs=None, processes=None):
+        """Backtest the model on its last `days` days of load data and store the errors.
+
+        With no `epochs` the trained model's forecasts are replayed, otherwise a model
+        is trained for each day, see `lf.backtest`. Defaults are from the config.
+        """
+        config = current_app.config
+        days = config["BACKTEST_DAYS"] if days is None else days
+        epochs = config["BACKTEST_EPOCHS"] if epochs is None else epochs
+        processes = config["BACKTEST_PROCESSES"] if processes is None else processes
+
+        model = None
+        if epochs == 0:
+            model = self.get_model()
+            if model is None:
+                raise Exception(f"Model {self.slug} has no saved model.")
+        data_split = self.get_data_split()
+        errors = lf.backtest(
+            data_split,
+            lf.backtest_origins(data_split, days=days),
+            model=model,
+            epochs=epochs,
+            processes=processes,
+            streaming=config["STREAMING_TRAINING"],
+        )
+        if epochs == 0 and not data_split.split_is_stored:
+            # NOTE: The model's split is unknown, so it may have been trained on any day
+            errors["trained_on"] = True
+        errors.to_parquet(self.backtest_path)
+        return errors
+
+    def get_backtest(self):
+        """Return the errors of the model's latest backtest, or None if it hasn't been backtested."""
+        if os.path.exists(self.backtest_path):
+            return pd.read_parquet(self.backtest_path)
+        return None
+
+    @classmethod
+    def get_reusable_model(cls, cached=False):
+        """Return the latest successful model, its keras model and feature params.
+
+        Raise an exception if it can't be reused with the current features, e.g. to
+        warm start training or to forecast without training. If `cached` is True the
+        keras model is shared through the model cache, so it must not be trained.
+        """
+        previous = cls.get_latest_successful()
+        input_shape = (current_app.config["HOURS_PRIOR"], len(lf.FEATURE_COLUMNS))
+
+        if previous is None:
+            raise Exception("There is no successful model.")
+        if not os.path.exists(previous.model_file):
+            raise Exception(f"Model {previous.slug} has no saved model.")
+        store = lf.load_feature_store(previous.feature_store_path)
+        if store is None:
+            raise Exception(f"Model {previous.slug} has no stored features.")
+        model = model_cache.get(previous) if cached else previous.get_model()
+        if (
+            store["columns"] != lf.FEATURE_COLUMNS
+            or model.input_shape[1:] != input_shape
+        ):
+            raise Exception(f"The features of model {previous.slug} have changed.")
+        return previous, model, store["params"]
+
+    def get_warm_start(self):
+        """Return the reusable model to fine-tune, see `get_reusable_model`.
+
+        Return None if there isn't one and WARM_START_FALLBACK is set, otherwise raise
+        an exception.
+        """
+        try:
+            warm_start = self.get_reusable_model()
+            # NOTE: The fine-tuned model is scored on the data since the previous one
+            if warm_start[0].start_date >= self.start_date:
+                raise Exception(
+                    f"There is no new data since model {warm_start[0].slug}."
+                )
+            return warm_start
+        except Exception as e:
+            if not current_app.config["WARM_START_FALLBACK"]:
+                raise Exception(f"Cannot warm start: {e}")
+            print(f"Cannot warm start, training from scratch: {e}")
+            return None
+
+    def execute_inference(self, previous, model, feature_params):
+        """Forecast with a trained model instead of training a new one, see `get_reusable_model`.
+
+        The keras model is copied to this model's output directory and its accuracy
+        is reused. No epochs are recorded because there was no training.
+        """
+        data_split = lf.DataSplit(
+            self.get_df(),
+            hours_prior=current_app.config["HOURS_PRIOR"],
+            feature_params=feature_params,
+            feature_store=self.feature_store_path,
         )
+        model.save(self.model_file)
+        self.accuracy = previous.accuracy
+        self.epochs = 0
+        # NOTE: The model may have been trained on any window before the previous one
+        seen = data_split.windows_before(previous.start_date)
+        data_split.save_split(seen, np.setdiff1d(data_split.labeled_windows(), seen))
 
         self.store_prediction_data(model, data_split)
         self.save()
+        self.store_detail_payload()
+        self.store_status(self.COMPLETED_SUCCESSFULLY)
+
+    @classmethod
+    def get_latest_successful(cls):
+        """Return the latest model that completed successfully, or None.
+
+        The model is found through its `LatestModel` pointer, which is set when the
+        pointer is missing, e.g. after the model it pointed to was deleted.
+        """
+        pointer = LatestModel.query.get(cls.COMPLETED_SUCCESSFULLY)
+        if pointer is not None:
+            return pointer.model
+
+        model = cls.find_latest_successful()
+        if model is not None:
+            LatestModel.update(model)
+            db.session.commit()
+        return model
+
+    @classmethod
+    def find_latest_successful(cls):
+        """Search all models for the latest that completed successfully, or return None."""
+        model = (
+            cls.query.join(TrainingJob)
+            .filter(TrainingJob.state == cls.COMPLETED_SUCCESSFULLY)
+            .order_by(cls.creation_date.desc())
+            .first()
+        )
+        if model is not None:
+            return model
+
+        # NOTE: Models trained before `TrainingJob` store their status in a file
+        query = (
+            cls.query.outerjoin(TrainingJob)
+            .filter(TrainingJob.id.is_(None))
+            .order_by(cls.creation_date.desc())
+        )
+        for model in query:
+            if model.exited_successfully:
+                return model
+        return None
 
     @classmethod
     def is_prepared(cls, is_prepared_dict=None):
@@ -304,6 +771,330 @@ class ForecastModel(db.Model):
         }
 
 
+class TrainingJob(db.Model):
+    """The training job of a forecast model, from being queued to exiting.
+
+    Jobs are trained first in, first out by at most TRAINING_WORKERS worker
+    processes, see `dispatch`. The queue is kept in the database, so queued jobs
+    are trained after the app restarts. Workers update the job's heartbeat while
+    training, so a job whose worker died is detected, see `is_alive`.
+    """
+
+    __tablename__ = "training_job"
+    id = Column(Integer, primary_key=True)
+    slug = Column(
+        String, ForeignKey("forecast_model.slug"), unique=True, nullable=False
+    )
+    model = relationship("ForecastModel", back_populates="job")
+    # Identical jobs train on the same data, see `submit`
+    key = Column(String)
+    # One of ForecastModel's status messages
+    state = Column(String, nullable=False)
+    pid = Column(Integer)
+    queued_at = Column(DateTime)
+    started_at = Column(DateTime)
+    heartbeat = Column(DateTime)
+    ended_at = Column(DateTime)
+    exit_reason = Column(String)
+
+    # Job states
+    QUEUED = ForecastModel.QUEUED
+    RUNNING = ForecastModel.RUNNING
+
+    @property
+    def is_alive(self):
+        """Return True if the job's worker sent a heartbeat recently."""
+        timeout = datetime.timedelta(
+            seconds=current_app.config["JOB_HEARTBEAT_TIMEOUT"]
+        )
+        return (
+            self.heartbeat is not None
+            and datetime.datetime.now() - self.heartbeat < timeout
+        )
+
+    @staticmethod
+    def job_key(start_date, end_date, epochs):
+        """Return the key of a job, models with the same key would be trained identically."""
+        return f"{start_date.isoformat()}/{end_date.isoformat()}/{epochs}"
+
+    @classmethod
+    def submit(cls, app_config):
+        """Queue a new forecast model and start a worker if one is free. Return the model.
+
+        Return None if an identical model is already queued.
+        """
+        is_prepared = ForecastModel.is_prepared()
+        if not is_prepared:
+            raise Exception("Database is not prepared to create a model.")
+        key = cls.job_key(
+            is_prepared["start_date"],
+            is_prepared["end_date"],
+            current_app.config["EPOCHS"],
+        )
+        if cls.query.filter_by(key=key, state=cls.QUEUED).first() is not None:
+            return None
+
+        # Use `quick_init` so we don't generate the dataframe until the worker
+        model = ForecastModel(quick_init=True)
+        model.job = cls(key=key, state=cls.QUEUED, queued_at=datetime.datetime.now())
+        model.save()
+
+        cls.dispatch(app_config)
+        return model
+
+    @classmethod
+    def dispatch(cls, app_config):
+        """Start worker processes for the queued jobs, up to TRAINING_WORKERS at once.
+
+        Every worker holds a `TrainingWorker` slot from before it starts until it
+        exits, so workers that haven't claimed a job yet count towards the limit.
+        """
+        cls.recover()
+        running = cls.query.filter_by(state=cls.RUNNING).count()
+        # Started workers that haven't claimed a job yet will claim a queued one
+        unclaimed = max(TrainingWorker.query.count() - running, 0)
+        queued = cls.query.filter_by(state=cls.QUEUED).count()
+        for _ in range(queued - unclaimed):
+            worker = TrainingWorker.reserve(current_app.config["TRAINING_WORKERS"])
+            if worker is None:
+                break
+            process = spawn.Process(
+                target=cls.run_worker, args=(app_config, worker.slot, worker.token)
+            )
+            process.start()
+            worker.started(process.pid)
+
+    @classmethod
+    def start_dispatcher(cls, app):
+        """Dispatch the queued jobs every TRAINING_DISPATCH_SECONDS in a thread of this process.
+
+        This resumes the queue after a restart and replaces workers that died.
+        """
+
+        def run():
+            with app.app_context():
+                while True:
+                    try:
+                        cls.dispatch(app.config["NAME"])
+                    except Exception as e:
+                        print(f"Cannot dispatch training jobs: {e}")
+                    finally:
+                        db.session.remove()
+                    time.sleep(app.config["TRAINING_DISPATCH_SECONDS"])
+
+        threading.Thread(target=run, daemon=True).start()
+
+    @classmethod
+    def recover(cls):
+        """Fail the running jobs whose worker has died, e.g. when it was killed or the app restarted."""
+        # Reap finished worker processes, otherwise they look alive
+        active_children()
+        TrainingWorker.recover()
+        for job in cls.query.filter_by(state=cls.RUNNING).all():
+            if not is_process_alive(job.pid):
+                reason = "The worker process died."
+            elif not job.is_alive:
+                reason = f"The worker process stopped responding at {job.heartbeat}."
+            else:
+                continue
+            job.model.store_status(ForecastModel.FAILURE, reason=reason)
+
+    @classmethod
+    def claim(cls):
+        """Mark the oldest queued job as run by this process and return it, or None if the queue is empty."""
+        for job in cls.query.filter_by(state=cls.QUEUED).order_by(cls.id).all():
+            now = datetime.datetime.now()
+            # NOTE: Only one worker can change the state, even across processes
+            claimed = cls.query.filter_by(id=job.id, state=cls.QUEUED).update(
+                {
+                    "state": cls.RUNNING,
+                    "pid": os.getpid(),
+                    "started_at": now,
+                    "heartbeat": now,
+                }
+            )
+            db.session.commit()
+            if claimed:
+                return cls.query.get(job.id)
+        return None
+
+    @classmethod
+    def beat(cls, app, job_id, stop):
+        """Update a job's heartbeat every JOB_HEARTBEAT_SECONDS until `stop` is set.
+
+        This runs in a thread of the worker, with its own database session.
+        """
+        with app.app_context():
+            while not stop.wait(app.config["JOB_HEARTBEAT_SECONDS"]):
+                cls.query.filter_by(id=job_id).update(
+                    {"heartbeat": datetime.datetime.now()}
+                )
+                db.session.commit()
+            db.session.remove()
+
+    @classmethod
+    def run_worker(cls, app_config, slot=None, token=None):
+        """Train the queued models one after another until the queue is empty.
+
+        This runs in its own process, see `dispatch`. The worker's `TrainingWorker`
+        slot is released when it exits.
+        """
+        from forecast_app import create_app
+
+        app = create_app(app_config)
+        app.app_context().push()
+
+        try:
+            cls.train_queue()
+        finally:
+            if slot is not None:
+                TrainingWorker.release(slot, token)
+
+    @classmethod
+    def train_queue(cls):
+        """Claim and train the queued jobs in this process until the queue is empty."""
+        job = cls.claim()
+        while job is not None:
+            print(f"Training model {job.slug}...")
+            stop = threading.Event()
+            heartbeat = threading.Thread(
+                target=cls.beat,
+                args=(current_app._get_current_object(), job.id, stop),
+                daemon=True,
+            )
+            heartbeat.start()
+            try:
+                job.model.train()
+            except Exception as e:
+                print(e)
+            finally:
+                stop.set()
+                heartbeat.join()
+                # Free the memory of the finished model
+                tf.keras.backend.clear_session()
+            job = cls.claim()
+
+
+class TrainingWorker(db.Model):
+    """A slot held by a training worker process, from before it starts until it exits.
+
+    There are TRAINING_WORKERS slots, so the table limits the workers across all of
+    the app's processes, see `TrainingJob.dispatch`.
+    """
+
+    __tablename__ = "training_worker"
+    slot = Column(Integer, primary_key=True)
+    # Identifies this use of the slot, so a worker only releases its own
+    token = Column(String, nullable=False)
+    pid = Column(Integer)
+    started_at = Column(DateTime, nullable=False)
+
+    @classmethod
+    def reserve(cls, slots):
+        """Take a free slot of the first `slots` and return it, or None if they're all taken."""
+        for slot in range(slots):
+            worker = cls(
+                slot=slot, token=uuid.uuid4().hex, started_at=datetime.datetime.now()
+            )
+            db.session.add(worker)
+            try:
+                db.session.commit()
+                return worker
+            except IntegrityError:
+                # Another worker holds the slot
+                db.session.rollback()
+        return None
+
+    def started(self, pid):
+        """Record the process of the worker that holds the slot."""
+        # NOTE: The worker may have already finished and released the slot
+        self.query.filter_by(slot=self.slot, token=self.token).update({"pid": pid})
+        db.session.commit()
+
+    @classmethod
+    def release(cls, slot, token):
+        """Free a slot, if it's still held by the worker with `token`."""
+        cls.query.filter_by(slot=slot, token=token).delete()
+        db.session.commit()
+
+    @classmethod
+    def recover(cls):
+        """Free the slots of workers that died, or that never started.
+
+        A worker is alive while it starts and while its jobs send heartbeats. Its
+        process id alone can't tell, e.g. a killed worker that another process
+        started stays a zombie until that process reaps it.
+        """
+        timeout = datetime.timedelta(
+            seconds=current_app.config["JOB_HEARTBEAT_TIMEOUT"]
+        )
+        for worker in cls.query.all():
+            last_seen = worker.started_at
+            if worker.pid is not None:
+                heartbeat = (
+                    db.session.query(func.max(TrainingJob.heartbeat))
+                    .filter(TrainingJob.pid == worker.pid)
+                    .filter(TrainingJob.heartbeat >= worker.started_at)
+                    .scalar()
+                )
+                last_seen = max(last_seen, heartbeat or last_seen)
+            is_dead = datetime.datetime.now() - last_seen > timeout or (
+                worker.pid is not None and not is_process_alive(worker.pid)
+            )
+            if is_dead:
+                db.session.delete(worker)
+        db.session.commit()
+
+
+class LatestModel(db.Model):
+    """A pointer to the latest model with a status, so it's found without searching every model.
+
+    Only the latest successful model is tracked, see `ForecastModel.get_latest_successful`.
+    """
+
+    __tablename__ = "latest_model"
+    status = Column(String, primary_key=True)
+    slug = Column(String, ForeignKey("forecast_model.slug"), nullable=False)
+    model = relationship("ForecastModel")
+
+    @classmethod
+    def update(cls, model):
+        """Point to the model if it's newer than the current one. Changes are not committed."""
+        pointer = cls.query.get(model.status)
+        if pointer is None:
+            db.session.add(cls(status=model.status, slug=model.slug))
+        elif pointer.model.creation_date <= model.creation_date:
+            pointer.slug = model.slug
+
+
+def is_process_alive(pid):
+    """Return True if a process with the given id is running on this machine."""
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class DataVersion(db.Model):
+    """A random version stamp per training data table, replaced whenever the table changes.
+
+    The stamp lives in the database so that every worker process can cheaply check
+    whether its cached copy of a table is still current.
+    """
+
+    __tablename__ = "data_version"
+    table_name = Column(String, primary_key=True)
+    version = Column(String, nullable=False)
+
+    def __repr__(self):
+        return f"<DataVersion {self.table_name}: {self.version}>"
+
+
 class TrainingData:
     """Abstract class for different types of data needed to make a forecast."""
 
@@ -314,6 +1105,18 @@ class TrainingData:
     milliseconds = Column(Integer)
     value = Column(Float)
 
+    @declared_attr
+    def __table_args__(cls):
+        # Covering index for the aggregate query in `is_prepared`
+        return (Index(f"ix_{cls.__tablename__}_value_timestamp", "value", "timestamp"),)
+
+    # Number of rows sent to the database per executemany batch in `upsert_df`
+    upsert_chunk_size = 5000
+
+    # Process-wide cache of values computed from each table:
+    #  {(table name, value name): (version, value)}
+    _cache = {}
+
     def __init__(self, timestamp=None, value=None):
         """Initialize the object with a timestamp and a value and generate remaining attributes."""
 
@@ -334,40 +1137,163 @@ class TrainingData:
         return cls.load_data("", df=df)
 
     @classmethod
-    def to_df(cls):
-        """Return a dataframe of the data in the database in the format used across the app."""
+    def get_version(cls):
+        """Return the table's current version stamp, or None if it has never been stamped."""
+        return (
+            db.session.query(DataVersion.version)
+            .filter_by(table_name=cls.__tablename__)
+            .scalar()
+        )
+
+    @classmethod
+    def stamp_version(cls):
+        """Stamp a table that has never been stamped, e.g. in a database from before the stamps, and return its version.
+
+        Changes are committed with the rest of the session.
+        """
+        db.session.add(
+            DataVersion(table_name=cls.__tablename__, version=uuid.uuid4().hex)
+        )
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another process stamped it first
+            db.session.rollback()
+        return cls.get_version()
+
+    @classmethod
+    def bump_version(cls):
+        """Stamp the table with a new version, invalidating every worker's cached dataframe.
+
+        Changes are committed with the rest of the session. Writes to the table that
+        bypass `upsert_df` must call this to be seen by `to_df`.
+        """
+        db.session.merge(
+            DataVersion(table_name=cls.__tablename__, version=uuid.uuid4().hex)
+        )
+
+    @classmethod
+    def _cached(cls, name, version, compute):
+        """Return `compute()`, reusing this process's last result while the table's version is unchanged."""
+        if version is None:
+            return compute()
+
+        key = (cls.__tablename__, name)
+        cached_version, value = cls._cache.get(key, (None, None))
+        if cached_version != version:
+            value = compute()
+            cls._cache[key] = (version, value)
+        return value
+
+    @classmethod
+    def to_df(cls, start=None, end=None):
+        """Return a dataframe of the data in the database in the format used across the app.
 
+        `start` and `end` optionally limit the (inclusive) range of timestamps returned.
+
+        The full table is cached per process until its version stamp changes. Each
+        caller gets its own copy, so modifying it never changes the cached dataframe.
+        A table that was never stamped is stamped, so it's cached from then on.
+        """
+
+        version = cls.get_version()
+        if version is None:
+            version = cls.stamp_version()
+
+        df = cls._cached("df", version, cls._fetch_df)
+        if start is None and end is None:
+            return df.copy()
+        in_window = pd.Series(True, index=df.index)
+        if start is not None:
+            in_window &= df["dates"] >= start
+        if end is not None:
+            in_window &= df["dates"] <= end
+        return df[in_window].reset_index(drop=True)
+
+    @classmethod
+    def _fetch_df(cls, start=None, end=None):
+        """Query the database for the dataframe returned by `to_df`.
+
+        Only the timestamp and value columns are selected, as plain tuples rather
+        than ORM objects.
+        """
+
+        query = db.session.query(cls.timestamp, cls.value).order_by(cls.timestamp)
+        if start is not None:
+            query = query.filter(cls.timestamp >= start)
+        if end is not None:
+            query = query.filter(cls.timestamp <= end)
+
+        rows = query.all()
+        timestamps, values = zip(*rows) if rows else ([], [])
+        # TODO: Rename dates to timestamp, or just make a universal var
         return pd.DataFrame(
-            [
-                # TODO: Rename dates to timestamp, or just make a universal var
-                {"dates": row.timestamp, cls.column_name: row.value}
-                for row in cls.query.all()
-            ]
+            {
+                "dates": np.array(timestamps, dtype="datetime64[ns]"),
+                # NOTE: Casting to float turns null values into NaNs
+                cls.column_name: np.array(values, dtype=np.float64),
+            }
         )
 
+    @classmethod
+    def get_summary(cls):
+        """Return the size, time span, and missing values of the table, or None if it's empty.
+
+        Computed in one pass over `to_df` and cached until the table changes.
+        """
+        return cls._cached("summary", cls.get_version(), cls._compute_summary)
+
+    @classmethod
+    def _compute_summary(cls):
+        """Compute the summary returned by `get_summary`."""
+        df = cls.to_df()
+        if df.empty:
+            return None
+
+        dates = df["dates"].to_numpy()
+        is_null = df[cls.column_name].isna().to_numpy()
+
+        # Find the start (inclusive) and end (exclusive) of every run of missing values
+        edges = np.flatnonzero(np.diff(np.concatenate([[False], is_null, [False]])))
+        run_starts, run_ends = edges[::2], edges[1::2]
+        if run_starts.size:
+            longest = np.argmax(run_ends - run_starts)
+            max_span = int(run_ends[longest] - run_starts[longest])
+            span_start = pd.Timestamp(dates[run_starts[longest]])
+            span_end = pd.Timestamp(dates[run_ends[longest] - 1])
+        else:
+            max_span, span_start, span_end = 0, None, None
+
+        return {
+            "count": len(df),
+            "start_datetime": pd.Timestamp(dates[0]),
+            "end_datetime": pd.Timestamp(dates[-1]),
+            "missing_values": {
+                "count": int(is_null.sum()),
+                "max_span": max_span,
+                "start_datetime": span_start,
+                "end_datetime": span_end,
+            },
+        }
+
     @classmethod
     def _parse_dates(cls, df, DATE_COL, HOUR_COL):
         """Parse an incoming dataframe's columns to correctly format the timestamps into the app's required format."""
 
-        # TODO: Test me!
         if "timestamp" not in df.columns:
             df[DATE_COL] = pd.to_datetime(df[DATE_COL])
 
-            # Hour column is in the form "HH00". This should work regardless of how
-            #  the hour column is formatted.
-            df[HOUR_COL] = df[HOUR_COL].astype(str).str.replace("00", "").astype(int)
+            # Hour column is either in the form "H" (0-23) or "HH00" (0-2300). Any
+            #  value above 99 must be in the latter form.
+            hours = pd.to_numeric(df[HOUR_COL]).astype(int)
+            hours = hours.where(hours < 100, hours // 100)
             # Some hours are in a different system and go up to 24 (?!)
-            if any(24 == df[HOUR_COL]):
-                df[HOUR_COL] -= 1
-
-            df["timestamp"] = df.apply(
-                lambda row: datetime.datetime(
-                    row[DATE_COL].year,
-                    row[DATE_COL].month,
-                    row[DATE_COL].day,
-                    row[HOUR_COL],
-                ),
-                axis=1,
+            if (hours == 24).any():
+                hours -= 1
+            df[HOUR_COL] = hours
+
+            df["timestamp"] = df[DATE_COL].dt.normalize() + pd.to_timedelta(
+                hours, unit="h"
             )
         df["timestamp"] = pd.to_datetime(df["timestamp"])
 
@@ -387,25 +1313,25 @@ class TrainingData:
 
         A model is prepared if there is there are at least `minimum_data_required` values in the database.
         """
-        df = cls.to_df()
-        if df.empty:
-            return {}
-
-        df = df.dropna(subset=[cls.column_name])
-        if df.shape[0] < cls.minimum_data_required:
+        count, start_date, end_date = (
+            db.session.query(
+                func.count(cls.value), func.min(cls.timestamp), func.max(cls.timestamp)
+            )
+            .filter(cls.value.isnot(None))
+            .one()
+        )
+        if count < cls.minimum_data_required:
             return {}
 
-        start_date, end_date = df.sort_values("dates")["dates"].agg(["min", "max"])
         return {
             "start_date": start_date,
             "end_date": end_date,
         }
 
     @classmethod
-    def load_data(cls, filepath, df=None):
-        """Given a filepath or a dataframe, parse the data and load it into the database of the given model."""
+    def prepare_df(cls, df):
+        """Format an uploaded dataframe into the `timestamp` and `value` columns stored in the database."""
 
-        # TODO: This is a mess. Separate out into different functions for easier testing.
         LOAD_COL = current_app.config["LOAD_COL"]
         TEMP_COL = current_app.config["TEMP_COL"]
         HOUR_COL = current_app.config["HOUR_COL"]
@@ -414,6 +1340,106 @@ class TrainingData:
         # TODO: Make a more immutable way of determining the value column
         VAL_COL = LOAD_COL if cls.column_name == "load" else TEMP_COL
 
+        # Some columns have spaces and quotes in their names.
+        df.columns = [col.lower().strip(' "') for col in df.columns]
+
+        df = cls._parse_dates(df, DATE_COL, HOUR_COL)
+
+        for column in df.columns:
+            if column not in ["timestamp", VAL_COL, HOUR_COL, DATE_COL]:
+                safe_flash(
+                    f'Warning: column "{column}" will not be imported.', "warning"
+                )
+
+        # Select only the columns relevant for this class
+        return df[["timestamp", VAL_COL]].rename(columns={VAL_COL: "value"})
+
+    @classmethod
+    def upsert_df(cls, df):
+        """Insert or update a dataframe of `timestamp` and `value` columns in bulk.
+
+        Existing timestamps are only updated if the new value isn't null. This is
+        particularly important for CSVs with discontinuous updates; If a user inputs
+        a CSV with multiple, random timestamps, we resample to create a continuous
+        datetime index. If we allow overwriting with null values, we'd set all values
+        between the largest and smallest timestamps to None.
+
+        Rows are written with a single `INSERT ... ON CONFLICT DO UPDATE` statement,
+        executed in batches of `upsert_chunk_size`. Return the number of inserted,
+        updated, and skipped rows.
+        """
+
+        df = df.dropna(subset=["timestamp"])
+        if df.empty:
+            return {"inserted": 0, "updated": 0, "skipped": 0}
+
+        # One range query to tell inserts from updates, rather than one query per row
+        existing = db.session.query(cls.timestamp).filter(
+            cls.timestamp.between(df["timestamp"].min(), df["timestamp"].max())
+        )
+        is_new = ~df["timestamp"].isin([timestamp for timestamp, in existing])
+        is_null = df["value"].isna()
+        df = df[is_new | ~is_null]
+
+        table = cls.__table__
+        stmt = sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.timestamp],
+            set_={
+                "milliseconds": stmt.excluded.milliseconds,
+                # NOTE: Null values are already filtered out above, coalesce is a safeguard.
+                "value": func.coalesce(stmt.excluded.value, table.c.value),
+            },
+        )
+
+        # NOTE: Sqlalchemy doesn't like pandas's custom NaN / NaT values, cast them here.
+        records = [
+            {"timestamp": timestamp, "milliseconds": milliseconds, "value": value}
+            for timestamp, milliseconds, value in zip(
+                df["timestamp"].dt.to_pydatetime(),
+                (df["timestamp"].astype("int64") // 10**6).tolist(),
+                df["value"].astype(object).where(df["value"].notna(), None).tolist(),
+            )
+        ]
+        for start in range(0, len(records), cls.upsert_chunk_size):
+            db.session.execute(stmt, records[start : start + cls.upsert_chunk_size])
+        cls.bump_version()
+        db.session.commit()
+
+        return {
+            "inserted": int(is_new.sum()),
+            "updated": int((~is_new & ~is_null).sum()),
+            "skipped": int((~is_new & is_null).sum()),
+        }
+
+    @classmethod
+    def _orm_upsert_df(cls, df):
+        """Row-by-row ORM equivalent of `upsert_df`, kept as a baseline for `cli.py benchmark-load-data`."""
+
+        counts = {"inserted": 0, "updated": 0, "skipped": 0}
+        is_empty = cls.query.count() == 0
+        for _, row in df.iterrows():
+            instance = None if is_empty else cls.query.get(row["timestamp"])
+            if not instance:
+                db.session.add(cls(timestamp=row["timestamp"], value=row["value"]))
+                counts["inserted"] += 1
+            elif not pd.isna(row["value"]):
+                instance.value = row["value"]
+                db.session.add(instance)
+                counts["updated"] += 1
+            else:
+                counts["skipped"] += 1
+        cls.bump_version()
+        db.session.commit()
+        return counts
+
+    @classmethod
+    def load_data(cls, filepath, df=None):
+        """Given a filepath or a dataframe, parse the data and load it into the database of the given model.
+
+        Return the counts of inserted, updated, and skipped rows, or None if loading failed.
+        """
+
         try:
             if df is None:
                 if str(filepath).endswith(".csv"):
@@ -423,55 +1449,15 @@ class TrainingData:
                 else:
                     safe_flash("File extension not recognized.", "danger")
 
-            # Some columns have spaces and quotes in their names.
-            df.columns = [col.lower().strip(' "') for col in df.columns]
-
-            df = cls._parse_dates(df, DATE_COL, HOUR_COL)
-
-            for column in df.columns:
-                if column not in ["timestamp", VAL_COL, HOUR_COL, DATE_COL]:
-                    safe_flash(
-                        f'Warning: column "{column}" will not be imported.', "warning"
-                    )
-
-            # Select only the columns relevant for this class
-            df = df[[VAL_COL, "timestamp"]]
-
-            # If uploading data for the first time, don't perform tens of thousands of queries
-            new_values = 0
-            if cls.query.count() == 0:
-                for _, row in df.iterrows():
-                    instance = cls(
-                        timestamp=row["timestamp"],
-                        value=row.get(VAL_COL),
-                    )
-                    db.session.add(instance)
-                    new_values += 1
-                db.session.commit()
-            else:
-                for _, row in df.iterrows():
-                    new_value = row.get(VAL_COL)
-                    instance = cls.query.get(row["timestamp"])
-                    # If the timestamp doesn't exist yet, create a new row.
-                    if not instance:
-                        instance = cls(
-                            timestamp=row["timestamp"],
-                            value=row.get(VAL_COL),
-                        )
-                        db.session.add(instance)
-                        new_values += 1
-                    # If the timestamp does exist, only update if the value isn't null.
-                    #  This is particularly important for CSVs with discontinuous updates;
-                    #  If a user inputs a CSV with multiple, random timestamps, we resample
-                    #  to create a continuous datetime index. If we allow overwriting with null values,
-                    #  we'd set all values between the largest and smallest timestamps to None.)
-                    elif not pd.isna(new_value):
-                        instance.value = new_value
-                        db.session.add(instance)
-                        new_values += 1
-                db.session.commit()
+            counts = cls.upsert_df(cls.prepare_df(df))
 
-            safe_flash(f"Success! Loaded {new_values} data points", "success")
+            safe_flash(
+                f"Success! Loaded {counts['inserted'] + counts['updated']} data points "
+                f"({counts['inserted']} new, {counts['updated']} updated, "
+                f"{counts['skipped']} empty values skipped)",
+                "success",
+            )
+            return counts
 
         except Exception as e:
             safe_flash("Error: failed to load data. " + str(e), "danger")
@@ -0,0 +1,96 @@
+"""Serve predictions from trained models kept in memory, rather than reloading them from disk."""
+
+import os
+import threading
+from collections import OrderedDict
+
+import tensorflow as tf
+
+
+class ModelCache:
+    """A least recently used cache of keras models, bounded by count and memory.
+
+    Models are keyed by their forecast model's slug. An entry is dropped when its
+    file changes or is removed, e.g. by `remove_old_models` in another process, so
+    the cache never serves a model that no longer exists on disk.
+    """
+
+    def __init__(self, max_models=4, max_megabytes=512):
+        self.max_models = max_models
+        self.max_bytes = max_megabytes * 2**20
+        # slug -> (model file, modification time, size in bytes, keras model)
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Set the bounds of the cache from the app's configuration."""
+        self.max_models = app.config["MODEL_CACHE_SIZE"]
+        self.max_bytes = app.config["MODEL_CACHE_MEGABYTES"] * 2**20
+
+    def __contains__(self, slug):
+        return slug in self._models
+
+    def __len__(self):
+        return len(self._models)
+
+    @property
+    def nbytes(self):
+        """Return the estimated memory used by the cached models' weights."""
+        return sum(entry[2] for entry in self._models.values())
+
+    def get(self, forecast_model):
+        """Return the keras model of a forecast model, loading it if it isn't cached. Return None if it has no model."""
+        slug = forecast_model.slug
+        path = forecast_model.model_file
+        with self._lock:
+            self._evict_deleted()
+            if not os.path.exists(path):
+                return None
+
+            mtime = os.path.getmtime(path)
+            entry = self._models.get(slug)
+            if entry is not None and entry[:2] == (path, mtime):
+                self._models.move_to_end(slug)
+                return entry[3]
+
+            model = tf.keras.models.load_model(path)
+            # NOTE: Weights are float32
+            self._models[slug] = (path, mtime, model.count_params() * 4, model)
+            self._shrink()
+            return model
+
+    def predict(self, forecast_model, X):
+        """Return the predictions of a forecast model's keras model for the input windows `X`."""
+        model = self.get(forecast_model)
+        if model is None:
+            raise Exception(f"Model {forecast_model.slug} has no saved model.")
+        return model.predict(X)
+
+    def evict(self, slug):
+        """Remove a model from the cache if it's there."""
+        with self._lock:
+            self._models.pop(slug, None)
+
+    def clear(self):
+        """Remove all models from the cache."""
+        with self._lock:
+            self._models.clear()
+
+    def _evict_deleted(self):
+        """Remove the models whose file has been removed."""
+        for slug, entry in list(self._models.items()):
+            if not os.path.exists(entry[0]):
+                del self._models[slug]
+
+    def _shrink(self):
+        """Remove the least recently used models until the cache is within its bounds.
+
+        The most recently used model is always kept, even if it's larger than the bound.
+        """
+        while len(self._models) > 1 and (
+            len(self._models) > self.max_models or self.nbytes > self.max_bytes
+        ):
+            self._models.popitem(last=False)
+
+
+model_cache = ModelCache()
@@ -1,7 +1,6 @@
-function create_timeseries_chart(id = null, series = null, title = null) {
+function create_timeseries_chart(id = null, series = null, title = null, data_url = null) {
   Highcharts.setOptions({ lang: { thousandsSep: ',' } });
-  // Create the chart
-  Highcharts.stockChart(id, {
+  var options = {
     rangeSelector: {
       selected: 1
     },
@@ -24,13 +23,35 @@ function create_timeseries_chart(id = null, series = null, title = null) {
         }
       }
     }
-  });
-};
+  };
 
-function toggle_table_visibility() {
-  $('#table-warning').toggleClass('d-none');
-  $('#large-table').toggleClass('d-none');
+  // The initial series is a downsampled overview. Request more detail as the user zooms in.
+  if (data_url) {
+    options.navigator = {
+      adaptToUpdatedData: false,
+      series: { data: series[0].data }
+    };
+    options.scrollbar = { liveRedraw: false };
+    options.xAxis = {
+      minRange: 3600 * 1000, // One hour
+      events: {
+        afterSetExtremes: function (e) {
+          var chart = this.chart;
+          chart.showLoading('Loading data...');
+          $.getJSON(data_url, { start: Math.round(e.min), end: Math.round(e.max) })
+            .done(function (data) {
+              data.forEach(function (new_series, i) {
+                chart.series[i].setData(new_series.data);
+              });
+            })
+            .always(function () {
+              chart.hideLoading();
+            });
+        }
+      }
+    };
+  }
 
-  text = $('#table-button').text()
-  $('#table-button').text(text == "Hide Table" ? "Show Table" : "Hide Table")
-}
\ No newline at end of file
+  // Create the chart
+  Highcharts.stockChart(id, options);
+};
@@ -0,0 +1,6 @@
+"""Benchmarks of the app's hot paths, run with `cli.py benchmark`."""
+
+# Sizes of the synthetic histories, in multiples of the demo data
+SCALES = [1, 5, 20]
+# Large histories take long enough that one round is representative
+ROUNDS = {1: 5, 5: 3, 20: 1}
@@ -0,0 +1,119 @@
+import os
+import shutil
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from forecast_app.commands import init_db
+from forecast_app.models import (
+    ForecastWeatherData,
+    HistoricalLoadData,
+    HistoricalWeatherData,
+    TrainingData,
+)
+
+BENCHMARK_DIR = Path(__file__).parent
+DEMO_DATA = Path("forecast_app/static/demo-data")
+
+try:
+    import pytest_benchmark  # noqa: F401
+except ImportError:
+    collect_ignore_glob = ["test_*.py"]
+
+
+def pytest_collection_modifyitems(config, items):
+    """Only run the benchmarks when they're asked for, see `cli.py benchmark`."""
+    if config.getoption("benchmark_only", False):
+        return
+    skip = pytest.mark.skip(reason="Benchmarks only run with --benchmark-only.")
+    for item in items:
+        if BENCHMARK_DIR in Path(str(item.fspath)).parents:
+            item.add_marker(skip)
+
+
+def scale_history(filepath, scale, output_path):
+    """Write the history in a CSV `scale` times over, each copy ending where the next one starts."""
+    df = pd.read_csv(filepath)
+    dates = pd.to_datetime(df["DATE"])
+    span = pd.Timedelta(days=(dates.max() - dates.min()).days + 1)
+    copies = [
+        df.assign(DATE=(dates - span * i).dt.strftime("%Y-%m-%d"))
+        for i in reversed(range(scale))
+    ]
+    pd.concat(copies).to_csv(output_path, index=False)
+    return output_path
+
+
+@pytest.fixture(scope="session")
+def histories(tmp_path_factory):
+    """Return the paths of the demo load and weather histories scaled up, by scale."""
+    tmp_dir = tmp_path_factory.mktemp("histories")
+    paths = {}
+
+    def get(scale):
+        if scale not in paths:
+            paths[scale] = {
+                cls: scale_history(
+                    DEMO_DATA / filename, scale, tmp_dir / f"{scale}x-{filename}"
+                )
+                for cls, filename in [
+                    (HistoricalLoadData, "demo-ncent-historical-load.csv"),
+                    (HistoricalWeatherData, "demo-ncent-historical-temp.csv"),
+                ]
+            }
+        return paths[scale]
+
+    return get
+
+
+@pytest.fixture(scope="session")
+def scaled_dbs(tmp_path_factory, histories):
+    """Return a function that loads a database of the scaled histories, like `load_demo_db`.
+
+    Loading the data is slow, so a backup is stored for each scale.
+    """
+    tmp_dir = tmp_path_factory.mktemp("databases")
+
+    def load(app, scale):
+        backup_path = tmp_dir / f"{scale}x.db"
+        test_path = (
+            "forecast_app/" + app.config["SQLALCHEMY_DATABASE_URI"].split("///")[1]
+        )
+        if os.path.exists(backup_path):
+            shutil.copyfile(backup_path, test_path)
+        else:
+            init_db()
+            for cls, path in histories(scale).items():
+                cls.load_data(path)
+            ForecastWeatherData.load_data(DEMO_DATA / "demo-ncent-forecast-temp.csv")
+            shutil.copyfile(test_path, backup_path)
+        # Each benchmark starts without cached dataframes
+        TrainingData._cache.clear()
+
+    return load
+
+
+@pytest.fixture
+def run_stage(benchmark):
+    """Return a function that benchmarks a stage and records its peak memory.
+
+    The stage is run once with tracemalloc to find the peak memory allocated (in
+    MiB) by Python and numpy, which is stored with the results. It's then timed
+    for `rounds` without tracing. `setup` is called before every run.
+    """
+
+    def run(function, setup=None, rounds=1):
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        try:
+            function()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info["peak_mib"] = peak / 2**20
+        return benchmark.pedantic(function, setup=setup, rounds=rounds, iterations=1)
+
+    return run
@@ -0,0 +1,59 @@
+"""Benchmarks of the ingest, query and feature stages, see `cli.py benchmark`."""
+
+import pytest
+
+import forecast_app.forecast as lf
+from forecast_app.models import ForecastModel, HistoricalLoadData, TrainingData
+from forecast_app.tests.benchmarks import ROUNDS, SCALES
+
+pytestmark = pytest.mark.parametrize("scale", SCALES, ids=lambda scale: f"{scale}x")
+
+
+def clear_cache():
+    TrainingData._cache.clear()
+
+
+def test_load_data(app, db, histories, run_stage, scale):
+    path = histories(scale)[HistoricalLoadData]
+
+    def clear_table():
+        HistoricalLoadData.query.delete()
+        db.session.commit()
+
+    counts = run_stage(
+        lambda: HistoricalLoadData.load_data(path),
+        setup=clear_table,
+        rounds=ROUNDS[scale],
+    )
+    assert counts["inserted"] > 0
+
+
+def test_to_df(app, db, scaled_dbs, run_stage, scale):
+    scaled_dbs(app, scale)
+    df = run_stage(HistoricalLoadData.to_df, setup=clear_cache, rounds=ROUNDS[scale])
+    assert df.shape[0] > 0
+
+
+def test_collect_training_data(app, db, scaled_dbs, run_stage, scale):
+    scaled_dbs(app, scale)
+    model = ForecastModel(quick_init=True)
+    df = run_stage(model.collect_training_data, setup=clear_cache, rounds=ROUNDS[scale])
+    assert df.shape[0] > 0
+
+
+def test_data_split(app, db, scaled_dbs, run_stage, scale):
+    scaled_dbs(app, scale)
+    df = ForecastModel(quick_init=True).collect_training_data()
+    data_split = run_stage(lambda: lf.DataSplit(df), rounds=ROUNDS[scale])
+    assert data_split.important_X.shape[0] > 0
+
+
+def test_data_view(app, db, client, auth, scaled_dbs, run_stage, scale):
+    auth.login()
+    scaled_dbs(app, scale)
+    response = run_stage(
+        lambda: client.get("/historical-load-data"),
+        setup=clear_cache,
+        rounds=ROUNDS[scale],
+    )
+    assert response.status_code == 200
@@ -9,6 +9,7 @@ from flask_sqlalchemy import SQLAlchemy
 from forecast_app import create_app
 from forecast_app.commands import init_db, upload_demo_data
 from forecast_app.config import TestingConfig
+from forecast_app.models import ForecastModel
 
 BACKUP_DB_PATH = "forecast_app/db/backup.db"
 
@@ -53,6 +54,23 @@ def db(app):
     os.unlink(db_path(app))
 
 
+@pytest.fixture
+def demo_model(app, db):
+    """Load the demo database and return its latest successful model.
+
+    The files a test stores for the model are removed afterwards, even if it fails.
+    """
+    load_demo_db(app)
+    model = ForecastModel.get_latest_successful()
+    paths = [model.model_file, model.backtest_path, model.feature_store_path]
+    yield model
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
 @pytest.fixture
 def client(app, db):
     with app.test_client() as client:
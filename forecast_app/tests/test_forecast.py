@@ -0,0 +1,301 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import tensorflow as tf
+from scipy.stats import zscore
+
+import forecast_app.forecast as lf
+
+
+@pytest.fixture(scope="module")
+def data_split():
+    df = pd.read_csv(
+        pytest.FIXTURE_DIR / "cached-dataframe.csv", parse_dates=["dates"]
+    ).head(24 * 60)
+    return lf.DataSplit(df)
+
+
+def legacy_exploded_data(df, hours_prior=24):
+    """The original pandas implementation of the features in `build_features`, without noise."""
+    r_df = pd.DataFrame()
+    r_df["load_n"] = df["load"] / (df["load"].max() - df["load"].min())
+    r_df["load_prev_n"] = r_df["load_n"].shift(hours_prior)
+    r_df["load_prev_n"].bfill(inplace=True)
+    r_df.drop(["load_n"], axis=1, inplace=True)
+    r_df["years_n"] = zscore(df["dates"].dt.year)
+    r_df = pd.concat(
+        [
+            r_df,
+            pd.get_dummies(df.dates.dt.hour, prefix="hour"),
+            pd.get_dummies(df.dates.dt.dayofweek, prefix="day"),
+            pd.get_dummies(df.dates.dt.month, prefix="month"),
+        ],
+        axis=1,
+    )
+    r_df["temp_n"] = zscore(df["tempc"])
+    r_df["temp_n^2"] = zscore([x * x for x in df["tempc"]])
+    return r_df
+
+
+def test_build_features():
+    df = pd.read_csv(pytest.FIXTURE_DIR / "cached-dataframe.csv", parse_dates=["dates"])
+    expected = legacy_exploded_data(df)
+    features, columns, params = lf.build_features(df, noise=0)
+    assert features.dtype == np.float32
+    assert columns == list(expected.columns)
+    assert np.allclose(features, expected.to_numpy(dtype=np.float64), atol=1e-5)
+
+    # The same parameters reproduce the same features on a subset of the data
+    subset_features, _, subset_params = lf.build_features(
+        df.tail(48).reset_index(drop=True), noise=0, params=params
+    )
+    assert subset_params == params
+    assert np.array_equal(subset_features[24:], features[-24:])
+
+    # Date features don't depend on which values are in the data
+    features, columns, _ = lf.build_features(df.head(24), noise=0)
+    assert features.shape == (24, len(lf.FEATURE_COLUMNS))
+    assert features[:, columns.index("years_n")].tolist() == [0] * 24
+
+
+def test_feature_store(tmp_path):
+    df = pd.read_csv(
+        pytest.FIXTURE_DIR / "cached-dataframe.csv", parse_dates=["dates"]
+    ).head(24 * 10)
+    path = tmp_path / "feature-store"
+    assert lf.load_feature_store(path) is None
+
+    # The features are built and saved on the first split ...
+    data_split = lf.DataSplit(df, feature_store=path)
+    assert not isinstance(data_split.features, np.memmap)
+    assert all((path / name).exists() for name in lf.FEATURE_STORE_FILES.values())
+
+    # ... and memory mapped afterwards
+    stored_split = lf.DataSplit(df, feature_store=path)
+    assert isinstance(stored_split.features, np.memmap)
+    assert isinstance(stored_split.targets, np.memmap)
+    assert np.array_equal(stored_split.features, data_split.features, equal_nan=True)
+    assert np.array_equal(stored_split.targets, data_split.targets, equal_nan=True)
+    assert np.array_equal(stored_split.all_X, data_split.all_X, equal_nan=True)
+    assert stored_split.feature_columns == data_split.feature_columns
+    assert stored_split.feature_params == data_split.feature_params
+
+    # A model's split is stored with the features and reused
+    assert not stored_split.split_is_stored
+    stored_split.save_split(np.arange(10), np.arange(10, 20))
+    stored_split = lf.DataSplit(df, feature_store=path)
+    assert stored_split.split_is_stored
+    assert stored_split.train_indices.tolist() == list(range(10))
+    assert stored_split.test_indices.tolist() == list(range(10, 20))
+
+    # A store that doesn't match the split is rebuilt, without the stored split
+    data_split = lf.DataSplit(df, hours_prior=12, feature_store=path)
+    assert not isinstance(data_split.features, np.memmap)
+    assert not data_split.split_is_stored
+    assert lf.load_feature_store(path)["hours_prior"] == 12
+    assert lf.load_split_indices(path) is None
+
+
+class TestDataSplit:
+    def test_3d_transform(self, data_split):
+        # Compare against copying each window
+        r_df = pd.DataFrame(np.arange(300).reshape(100, 3))
+        expected = np.array([r_df.to_numpy()[i : i + 24] for i in range(100 - 24)])
+        windows = data_split._3d_transform(r_df)
+        assert windows.shape == (76, 24, 3)
+        assert np.array_equal(windows, expected)
+        # ... without copying the data
+        assert np.shares_memory(windows, r_df.to_numpy())
+
+        series = pd.Series(np.arange(100))
+        expected = np.array([series.to_numpy()[i : i + 24] for i in range(100 - 24)])
+        assert np.array_equal(data_split._3d_transform(series), expected)
+
+    def test_split(self, data_split):
+        n_windows = data_split.all_X.shape[0]
+        assert data_split.all_X.shape == (n_windows, 24, data_split.feature_count)
+        assert data_split.all_y.shape == (n_windows, 24)
+        for array in [data_split.features, data_split.targets, data_split.important_X]:
+            assert array.dtype == np.float32
+            assert array.flags["C_CONTIGUOUS"]
+        assert data_split.all_X.dtype == data_split.all_y.dtype == np.float32
+
+        indices = np.concatenate([data_split.train_indices, data_split.test_indices])
+        # The last day is held out, and no window is in both sets
+        assert sorted(indices) == list(range(n_windows - 24))
+        assert data_split.train_X.shape[0] == len(data_split.train_indices)
+
+    def test_sequence(self, data_split):
+        sequence = data_split.sequence("test", batch_size=10)
+        assert len(sequence) == int(np.ceil(len(data_split.test_indices) / 10))
+        X, y = sequence[0]
+        assert X.shape == (10, 24, data_split.feature_count)
+        assert np.array_equal(X, data_split.test_X[:10], equal_nan=True)
+        assert np.array_equal(y, data_split.test_y[:10])
+
+        # Training batches are shuffled every epoch
+        sequence = data_split.sequence("train")
+        indices = sequence.indices.copy()
+        sequence.on_epoch_end()
+        assert sorted(indices) == sorted(sequence.indices)
+        assert not np.array_equal(indices, sequence.indices)
+
+    def test_dataset(self, data_split):
+        dataset = data_split.dataset("test", batch_size=10)
+        X, y = next(iter(dataset))
+        assert X.shape == (10, 24, data_split.feature_count)
+        assert np.array_equal(X.numpy(), data_split.test_X[:10], equal_nan=True)
+        assert np.array_equal(y.numpy(), data_split.test_y[:10])
+
+        # Every training window is streamed exactly once per epoch
+        batches = list(data_split.dataset("train", batch_size=100))
+        assert sum(X.shape[0] for X, _ in batches) == len(data_split.train_indices)
+
+    def test_warm_start_split(self, data_split):
+        since = data_split.df.dates[1000]
+        train_indices, test_indices = data_split.warm_start_split(since, replay=0.1)
+        assert not set(train_indices) & set(test_indices)
+
+        # Like the split, the last day is held out
+        windows = np.arange(data_split.all_X.shape[0] - 24)
+        is_new = data_split.window_dates(windows + 23) >= np.datetime64(since)
+        # Only new windows are held out, a fifth of them
+        assert set(test_indices) <= set(windows[is_new])
+        assert len(test_indices) == pytest.approx(is_new.sum() * 0.2, abs=1)
+        assert set(windows[is_new]) <= set(train_indices) | set(test_indices)
+        # ... and a tenth of the old windows are replayed
+        assert len(train_indices) + len(test_indices) - is_new.sum() == int(
+            (~is_new).sum() * 0.1
+        )
+
+        with pytest.raises(Exception, match="too little data"):
+            data_split.warm_start_split(data_split.df.dates.iloc[-1])
+
+    def test_warm_start(self, data_split):
+        # The forecast day has no load data, see `collect_training_data`
+        df = data_split.df.copy()
+        df.loc[df.index[-24:], "load"] = np.nan
+        data_split = lf.DataSplit(df)
+        model, _ = lf.train_and_test_model(data_split, epochs=1)
+        weights = model.get_weights()
+
+        train_indices, test_indices = data_split.warm_start_split(
+            data_split.df.dates[1000]
+        )
+        tuned_model, accuracy = lf.train_and_test_model(
+            data_split,
+            epochs=1,
+            model=model,
+            train_indices=train_indices,
+            test_indices=test_indices,
+        )
+        assert tuned_model is model
+        assert not np.array_equal(weights[-1], tuned_model.get_weights()[-1])
+        assert np.isfinite(tuned_model.get_weights()[-1]).all()
+        assert set(accuracy) == {"train", "test"}
+        assert np.isfinite(accuracy["train"]) and np.isfinite(accuracy["test"])
+
+    def test_train_ensemble(self, tmp_path):
+        df = pd.read_csv(
+            pytest.FIXTURE_DIR / "cached-dataframe.csv", parse_dates=["dates"]
+        ).head(24 * 60)
+        data_split = lf.DataSplit(df, feature_store=tmp_path / "feature-store")
+        member_files = [str(tmp_path / f"member-{i}.h5") for i in range(2)]
+        save_file = str(tmp_path / "ensemble.h5")
+
+        model, accuracy = lf.train_ensemble(
+            data_split, member_files, epochs=1, save_file=save_file, processes=2
+        )
+        assert len(accuracy["members"]) == 2
+        assert all(os.path.exists(member_file) for member_file in member_files)
+
+        # The forecast is the mean of the members
+        model = tf.keras.models.load_model(save_file)
+        assert len(lf.ensemble_members(model)) == 2
+        predictions, lower, upper = lf.predict_with_spread(
+            model, data_split.important_X
+        )
+        assert predictions == pytest.approx(
+            model.predict(data_split.important_X).flatten(), rel=1e-4
+        )
+        assert (lower <= upper).all()
+
+        # A single model has no spread
+        _, lower, upper = lf.predict_with_spread(
+            lf.build_model(data_split.feature_count), data_split.important_X
+        )
+        assert lower is None and upper is None
+
+    def test_backtest(self, data_split, tmp_path):
+        origins = lf.backtest_origins(data_split, days=5)
+        assert len(origins) == 5
+        assert (data_split.df.dates.iloc[origins].dt.hour == 0).all()
+
+        model = lf.build_model(data_split.feature_count)
+        errors = lf.backtest(data_split, origins, model=model)
+        assert errors.shape == (5, 25)
+        assert errors.index[-1] == data_split.df.dates.iloc[origins[-1]]
+        # Days that share an hour with a training window were trained on
+        assert errors.trained_on.tolist() == [
+            (np.abs(data_split.train_indices - origin) < 24).any() for origin in origins
+        ]
+        split_indices = data_split.train_indices, data_split.test_indices
+        data_split.train_indices = np.array([origins[1] - 23, origins[3] + 23])
+        errors = lf.backtest(data_split, origins, model=model)
+        assert errors.trained_on.tolist() == [False, True, False, True, False]
+        data_split.train_indices, data_split.test_indices = split_indices
+
+        # Hours without load have no percentage error
+        all_y = data_split.all_y
+        data_split.all_y = all_y.copy()
+        data_split.all_y[origins[0], 0] = 0
+        errors_with_zero = lf.backtest(data_split, origins, model=model)
+        data_split.all_y = all_y
+        assert np.isnan(errors_with_zero.hour_0.iloc[0])
+        assert errors_with_zero.hour_1.iloc[0] == errors.hour_1.iloc[0]
+        assert len(lf.backtest_origins(data_split, days=0)) == 0
+        assert len(lf.backtest(data_split, [], model=model)) == 0
+
+        by_day, by_hour = lf.backtest_tables(errors)
+        assert by_day.mape.tolist() == pytest.approx(
+            errors.drop(columns="trained_on").mean(axis=1).tolist()
+        )
+        assert by_hour.shape == (24, 1)
+
+        # Train a model for each origin instead
+        df = data_split.df.head(24 * 30)
+        data_split = lf.DataSplit(df, feature_store=tmp_path / "feature-store")
+        origins = lf.backtest_origins(data_split, days=2)
+        errors = lf.backtest(data_split, origins, epochs=1, processes=2)
+        assert errors.shape == (2, 25)
+        assert not errors.trained_on.any()
+        assert errors.drop(columns="trained_on").notna().all().all()
+
+    def test_float32_accuracy(self):
+        """Training on float32 arrays is as accurate as on float64 arrays.
+
+        Both models are trained from the same seed on the same windows, for one short
+        epoch, so only the precision of the arrays differs.
+        """
+        df = pd.read_csv(
+            pytest.FIXTURE_DIR / "cached-dataframe.csv", parse_dates=["dates"]
+        ).head(24 * 20)
+        accuracies = {}
+        split_indices = None
+        for dtype in [np.float64, np.float32]:
+            # NOTE: This seeds numpy too, so the temperature noise is the same
+            tf.keras.utils.set_random_seed(0)
+            data_split = lf.DataSplit(df, dtype=dtype)
+            assert data_split.features.dtype == dtype
+            if split_indices is None:
+                split_indices = data_split.train_indices, data_split.test_indices
+            data_split.train_indices, data_split.test_indices = split_indices
+            tf.keras.utils.set_random_seed(0)
+            _, accuracies[dtype] = lf.train_and_test_model(data_split, epochs=1)
+
+        for subset in ["train", "test"]:
+            assert accuracies[np.float32][subset] == pytest.approx(
+                accuracies[np.float64][subset], rel=0.05
+            )
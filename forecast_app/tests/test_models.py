@@ -1,18 +1,25 @@
 import os
 import signal
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from multiprocessing import Process
 from pathlib import Path
 from time import sleep
+from unittest.mock import patch
 
+import numpy as np
 import pandas as pd
 import pytest
+from hypothesis import given, settings
+from hypothesis import strategies as st
 
+import forecast_app.forecast as lf
 from forecast_app.models import (
     ForecastModel,
     ForecastWeatherData,
     HistoricalLoadData,
     HistoricalWeatherData,
+    TrainingJob,
+    TrainingWorker,
 )
 
 # TODO: Test that submitting a temperature csv to the load data view works
@@ -46,6 +53,30 @@ class TestHistoricalLoadData:
         # ensure that values in between the timestamps aren't overwritten with NaN
         assert not pd.isna(HistoricalLoadData.query.get(datetime(2002, 1, 1, 5)).value)
 
+    def test_upsert_df(self, db, app):
+        fixture_path = pytest.FIXTURE_DIR / "uncontinuous.csv"
+        counts = HistoricalLoadData.load_data(fixture_path)
+        assert counts == {"inserted": 72, "updated": 0, "skipped": 0}
+
+        # The update only has two values, the 32 resampled hours in between are empty
+        fixture_path = pytest.FIXTURE_DIR / "historical-load-update.csv"
+        counts = HistoricalLoadData.load_data(fixture_path)
+        assert counts == {"inserted": 0, "updated": 2, "skipped": 32}
+        assert HistoricalLoadData.query.count() == 72
+
+        df = pd.DataFrame(
+            {
+                "timestamp": [datetime(2002, 1, 1, 0), datetime(2002, 1, 4, 0)],
+                "value": [None, 1.0],
+            }
+        )
+        counts = HistoricalLoadData.upsert_df(df)
+        assert counts == {"inserted": 1, "updated": 0, "skipped": 1}
+        assert HistoricalLoadData.query.get(datetime(2002, 1, 1, 0)).value is not None
+        obj = HistoricalLoadData.query.get(datetime(2002, 1, 4, 0))
+        assert obj.value == 1.0
+        assert obj.milliseconds == pd.Timestamp(obj.timestamp).timestamp() * 1000
+
     def test_init(self, db):
         obj = HistoricalLoadData(timestamp=datetime(2020, 1, 1), value=42.0)
         db.session.add(obj)
@@ -117,21 +148,45 @@ class TestForecastModel:
         new_model = ForecastModel()
         assert not new_model.is_running
         assert not new_model.exited_successfully
-        assert not os.path.exists(new_model.process_file)
+        assert new_model.status == new_model.NOT_STARTED
 
         process = Process(target=new_model.execute_forecast)
         process.start()
-        new_model.store_process_id(process.pid)
+        new_model.store_status(new_model.RUNNING, pid=process.pid)
         assert new_model.is_running
         assert not new_model.exited_successfully
-        assert os.path.exists(new_model.process_file)
-        assert new_model.get_process_id() == str(process.pid)
+        assert new_model.job.pid == process.pid
+        assert new_model.job.started_at is not None
 
         new_model.cancel()
         sleep(2)  # Give the process time to cancel
         assert process.exitcode == -signal.SIGKILL
         assert not new_model.is_running
         assert not new_model.exited_successfully
+        assert new_model.job.exit_reason == "Cancelled"
+        assert new_model.job.ended_at is not None
+
+    def test_status(self, app, db):
+        pytest.load_demo_db(app)
+        model = ForecastModel()
+        model.store_status(model.RUNNING, pid=os.getpid())
+        assert model.is_running
+
+        # Running models without a recent heartbeat have failed
+        model.job.heartbeat -= timedelta(seconds=app.config["JOB_HEARTBEAT_TIMEOUT"])
+        assert model.status == model.FAILURE
+
+        # Models trained before jobs were stored read their process file
+        model.job = None
+        assert model.status == model.NOT_STARTED
+        for status, expected in [
+            ("COMPLETED", model.COMPLETED_SUCCESSFULLY),
+            ("FAILURE", model.FAILURE),
+            ("1234", model.FAILURE),
+        ]:
+            with open(model.process_file, "w") as f:
+                f.write(status)
+            assert model.status == expected
 
     def test_launch_model(self):
         pass
@@ -143,6 +198,197 @@ class TestForecastModel:
         df = model.get_df()
         assert not any(["Unnamed" in col for col in df.columns])
 
+        # Only the requested columns that exist are read
+        projected_df = model.get_df(columns=["dates", "load", "forecasted_load"])
+        assert list(projected_df.columns) == ["dates", "load"]
+        assert projected_df.equals(df[["dates", "load"]])
+
+        # Models stored as CSV are still read
+        os.remove(model.df_path)
+        df.to_csv(model.csv_df_path, index=False)
+        csv_df = model.get_df(columns=["dates", "load"])
+        assert csv_df.dates.dtype == df.dates.dtype
+        assert np.allclose(csv_df.load, df.load, equal_nan=True)
+
+        # ... until the dataframe is stored again
+        model.store_df(csv_df)
+        assert os.path.exists(model.df_path)
+        assert not os.path.exists(model.csv_df_path)
+
+    def test_feature_store(self, app, db):
+        pytest.load_demo_db(app)
+        model = ForecastModel()
+        assert not os.path.exists(model.feature_store_path)
+
+        data_split = model.get_data_split()
+        assert os.path.exists(model.feature_store_path)
+        assert isinstance(model.get_data_split().features, np.memmap)
+
+        # Storing predictions keeps the features, storing new data removes them
+        model.store_df(data_split.df, keep_feature_store=True)
+        assert os.path.exists(model.feature_store_path)
+        model.store_df(data_split.df)
+        assert not os.path.exists(model.feature_store_path)
+
+    def test_detail_payload(self, app, db):
+        pytest.load_demo_db(app)
+        model = ForecastModel.query.first()
+        assert model.exited_successfully
+        df = model.get_df()
+
+        # The payload of a completed model is stored the first time it's requested
+        assert not os.path.exists(model.detail_payload_path)
+        payload = model.get_detail_payload()
+        assert os.path.exists(model.detail_payload_path)
+        assert payload["accuracy"] == model.accuracy
+        assert payload["peak_info"]["on_peak"]["timestamp"].month == 12
+
+        load, forecast = payload["training_chart"]
+        assert len(load["data"]) == len(forecast["data"]) == df.shape[0]
+        assert load["data"][0] == [df.dates[0].timestamp() * 1000, df.load[0]]
+        # NaNs are stored as null
+        assert load["data"][-1][1] is None
+
+        with patch.object(ForecastModel, "compute_detail_payload") as compute:
+            assert model.get_detail_payload() == payload
+            compute.assert_not_called()
+
+        # Storing a new dataframe removes the outdated payload
+        model.store_df(df)
+        assert not os.path.exists(model.detail_payload_path)
+
+    def test_warm_start(self, app, demo_model):
+        previous = demo_model
+        model = ForecastModel()
+
+        # The demo models weren't trained
+        assert model.get_warm_start() is None
+        app.config["WARM_START_FALLBACK"] = False
+        with pytest.raises(Exception, match="has no saved model"):
+            model.get_warm_start()
+
+        lf.build_model(len(lf.FEATURE_COLUMNS)).save(previous.model_file)
+        with pytest.raises(Exception, match="has no stored features"):
+            model.get_warm_start()
+
+        data_split = previous.get_data_split()
+        with pytest.raises(Exception, match="no new data since model"):
+            model.get_warm_start()
+
+        model.start_date = previous.start_date + timedelta(days=1)
+        warm_start, keras_model, feature_params = model.get_warm_start()
+        assert warm_start.slug == previous.slug
+        assert keras_model.input_shape == (None, 24, len(lf.FEATURE_COLUMNS))
+        assert feature_params == data_split.feature_params
+
+        # Models with other features are not warm started
+        lf.build_model(3).save(previous.model_file)
+        with pytest.raises(Exception, match="features of model .* have changed"):
+            model.get_warm_start()
+
+    def test_execute_warm_start(self, app, demo_model):
+        previous = demo_model
+        lf.build_model(len(lf.FEATURE_COLUMNS)).save(previous.model_file)
+        previous.get_data_split()
+        # Pretend the previous model was trained before the last 10 days of data
+        since = previous.start_date - timedelta(days=10)
+        previous.start_date = since
+        previous.save()
+
+        app.config["WARM_START"] = True
+        app.config["WARM_START_EPOCHS"] = 1
+        model = ForecastModel()
+        with patch(
+            "forecast_app.forecast.train_and_test_model",
+            wraps=lf.train_and_test_model,
+        ) as train:
+            model.execute_forecast()
+        assert model.epochs == 1
+
+        # The model is only scored on windows the previous model never saw
+        data_split = train.call_args.args[0]
+        test_indices = train.call_args.kwargs["test_indices"]
+        window_ends = data_split.window_dates(test_indices + 23)
+        assert (window_ends >= np.datetime64(since)).all()
+        # ... and every window before it is stored as possibly trained on
+        train_indices, stored_test_indices = lf.load_split_indices(
+            model.feature_store_path
+        )
+        assert np.array_equal(stored_test_indices, test_indices)
+        assert set(data_split.windows_before(since)) <= set(train_indices)
+
+    def test_execute_inference(self, demo_model):
+        previous = demo_model
+        lf.build_model(len(lf.FEATURE_COLUMNS)).save(previous.model_file)
+        previous.get_data_split()
+
+        model = ForecastModel()
+        model.execute_inference(*ForecastModel.get_reusable_model())
+        assert ForecastModel.get_latest_successful().slug == model.slug
+        assert os.path.exists(model.model_file)
+        assert model.epochs == 0
+        assert model.accuracy == previous.accuracy
+        assert model.get_df().forecasted_load.notna().any()
+        assert os.path.exists(model.detail_payload_path)
+
+    def test_backtest(self, demo_model):
+        model = demo_model
+        assert model.get_backtest() is None
+        with pytest.raises(Exception, match="has no saved model"):
+            model.backtest(days=3)
+
+        lf.build_model(len(lf.FEATURE_COLUMNS)).save(model.model_file)
+        errors = model.backtest(days=3)
+        assert len(errors) == 3
+        pd.testing.assert_frame_equal(model.get_backtest(), errors)
+        # The model's split wasn't stored, so it may have been trained on any day
+        assert errors.trained_on.all()
+
+        # Only the days the model was trained on are flagged
+        data_split = model.get_data_split()
+        origins = lf.backtest_origins(data_split, days=3)
+        data_split.save_split(origins[:1], origins[1:])
+        errors = model.backtest(days=3)
+        assert errors.trained_on.tolist() == [True, False, False]
+
+    def test_ensemble_prediction_data(self, demo_model):
+        previous = demo_model
+        members = [lf.build_model(len(lf.FEATURE_COLUMNS)) for _ in range(2)]
+        lf.build_ensemble(members).save(previous.model_file)
+        previous.get_data_split()
+
+        model = ForecastModel()
+        model.execute_inference(*ForecastModel.get_reusable_model())
+        df = model.get_df().dropna(subset=["forecasted_load"])
+        assert (df.forecasted_load_lower <= df.forecasted_load + 1e-3).all()
+        assert (df.forecasted_load <= df.forecasted_load_upper + 1e-3).all()
+        forecast_chart = model.get_detail_payload()["forecast_chart"]
+        assert [series["name"] for series in forecast_chart[-2:]] == [
+            "Ensemble lower bound",
+            "Ensemble upper bound",
+        ]
+
+    def test_get_latest_successful(self, app, db):
+        pytest.load_demo_db(app)
+        latest = ForecastModel.get_latest_successful()
+        assert latest.exited_successfully
+
+        # The latest model is found without searching the models
+        with patch.object(ForecastModel, "find_latest_successful") as find:
+            assert ForecastModel.get_latest_successful().slug == latest.slug
+            model = ForecastModel()
+            model.store_status(model.COMPLETED_SUCCESSFULLY)
+            assert ForecastModel.get_latest_successful().slug == model.slug
+            find.assert_not_called()
+
+        # ... even if an older model completes later
+        latest.store_status(latest.COMPLETED_SUCCESSFULLY)
+        assert ForecastModel.get_latest_successful().slug == model.slug
+
+        # Deleting the latest model points to the next latest
+        model.delete()
+        assert ForecastModel.get_latest_successful().slug == latest.slug
+
     def test_collect_training_data(self, app, db):
         pytest.load_demo_db(app)
         model = ForecastModel.query.first()
@@ -170,6 +416,165 @@ class TestForecastModel:
         model.store_df(df)
 
 
+def patch_spawn():
+    """Mock the started workers, which stay alive and never claim a job."""
+    return patch(
+        "forecast_app.models.spawn", **{"Process.return_value.pid": os.getpid()}
+    )
+
+
+class TestTrainingJob:
+    def test_submit(self, app, db):
+        pytest.load_demo_db(app)
+        with patch_spawn() as spawn:
+            process = spawn.Process
+            model = TrainingJob.submit("test")
+            assert model.is_queued
+            assert TrainingJob.query.filter_by(slug=model.slug).one().state == "QUEUED"
+            process.assert_called_once()
+
+            # Identical jobs are only queued once
+            assert TrainingJob.submit("test") is None
+            assert TrainingJob.query.filter_by(state="QUEUED").count() == 1
+
+            # ... but others are, and start workers while they are free
+            # NOTE: The first worker hasn't claimed its job, but will
+            process.reset_mock()
+            app.config["EPOCHS"] += 1
+            app.config["TRAINING_WORKERS"] = 2
+            TrainingJob.submit("test")
+            assert process.call_count == 1
+
+        # Queued models can be cancelled
+        model.cancel()
+        assert model.status == model.FAILURE
+        assert TrainingJob.query.filter_by(state="QUEUED").count() == 1
+
+    def test_dispatch(self, app, db):
+        pytest.load_demo_db(app)
+        app.config["TRAINING_WORKERS"] = 2
+        with patch_spawn() as spawn:
+            for _ in range(3):
+                TrainingJob.submit("test")
+                app.config["EPOCHS"] += 1
+            # Dispatching again, e.g. periodically, doesn't start more
+            for _ in range(3):
+                TrainingJob.dispatch("test")
+            assert spawn.Process.call_count == 2
+            assert TrainingWorker.query.count() == 2
+
+            # A worker that exits frees its slot for the next one
+            worker = TrainingWorker.query.first()
+            TrainingWorker.release(worker.slot, worker.token)
+            TrainingJob.dispatch("test")
+            assert spawn.Process.call_count == 3
+
+        # ... as does a worker that died
+        process = Process(target=int)
+        process.start()
+        process.join()
+        TrainingWorker.query.update({"pid": process.pid})
+        db.session.commit()
+        TrainingWorker.recover()
+        assert TrainingWorker.query.count() == 0
+
+        # ... or whose jobs stopped sending heartbeats, even if its process lingers
+        timeout = timedelta(seconds=app.config["JOB_HEARTBEAT_TIMEOUT"])
+        worker = TrainingWorker.reserve(1)
+        worker.started(os.getpid())
+        worker.started_at -= 2 * timeout
+        db.session.commit()
+        job = TrainingJob.claim()
+        TrainingWorker.recover()
+        assert TrainingWorker.query.count() == 1
+        job.heartbeat -= timeout
+        db.session.commit()
+        TrainingWorker.recover()
+        assert TrainingWorker.query.count() == 0
+
+    def test_start_dispatcher(self, app, db):
+        app.config["TRAINING_DISPATCH_SECONDS"] = 5
+        with patch.object(TrainingJob, "dispatch") as dispatch, patch(
+            "forecast_app.models.time.sleep", side_effect=SystemExit
+        ) as sleep, patch("forecast_app.models.threading.Thread") as thread:
+            TrainingJob.start_dispatcher(app)
+            thread.return_value.start.assert_called_once()
+            # Run one round of the thread
+            with pytest.raises(SystemExit):
+                thread.call_args.kwargs["target"]()
+        dispatch.assert_called_once_with("test")
+        sleep.assert_called_once_with(5)
+
+    def test_run_worker(self, app, db):
+        pytest.load_demo_db(app)
+        with patch_spawn():
+            first = TrainingJob.submit("test")
+            app.config["EPOCHS"] += 1
+            second = TrainingJob.submit("test")
+        worker = TrainingWorker.query.one()
+
+        trained = []
+        # NOTE: Mock the app, the worker runs in the current app context here
+        with patch("forecast_app.create_app"), patch.object(
+            ForecastModel, "train", lambda model: trained.append(model.slug)
+        ):
+            TrainingJob.run_worker("test", worker.slot, worker.token)
+        # Jobs are trained in order
+        assert trained == [first.slug, second.slug]
+        assert TrainingJob.query.filter_by(state="QUEUED").count() == 0
+        assert TrainingJob.claim() is None
+        # The worker frees its slot
+        assert TrainingWorker.query.count() == 0
+
+    def test_cancel(self, app, db):
+        pytest.load_demo_db(app)
+        with patch_spawn():
+            model = TrainingJob.submit("test")
+        worker = TrainingWorker.query.one()
+
+        # Claim the job with a worker that's still training
+        process = Process(target=sleep, args=(60,))
+        process.start()
+        job = TrainingJob.claim()
+        job.pid = process.pid
+        db.session.commit()
+        worker.started(process.pid)
+
+        model.cancel()
+        process.join(5)
+        assert not process.is_alive()
+        assert model.status == model.FAILURE
+        assert job.exit_reason == "Cancelled"
+        # The killed worker can't free its slot, so it's freed for it
+        assert TrainingWorker.query.count() == 0
+
+    def test_recover(self, app, db):
+        pytest.load_demo_db(app)
+        with patch_spawn():
+            model = TrainingJob.submit("test")
+
+        # Claim the job with a process that dies
+        process = Process(target=int)
+        process.start()
+        job = TrainingJob.claim()
+        assert job.slug == model.slug and job.state == "RUNNING"
+        job.pid = process.pid
+        db.session.commit()
+        process.join()
+
+        TrainingJob.recover()
+        assert model.status == model.FAILURE
+        assert job.exit_reason == "The worker process died."
+
+        # ... or that stops sending heartbeats
+        model.store_status(model.RUNNING, pid=os.getpid())
+        job.heartbeat -= timedelta(seconds=app.config["JOB_HEARTBEAT_TIMEOUT"])
+        db.session.commit()
+        TrainingJob.recover()
+        assert job.state == model.FAILURE
+        assert "stopped responding" in job.exit_reason
+
+
 def test_is_prepared(app, db):
     # Combine tests to make tests faster
     # FORECAST MODEL
@@ -178,6 +583,22 @@ def test_is_prepared(app, db):
         is_prepared = cls.is_prepared()
         assert not is_prepared
 
+    # Null values don't count towards the minimum
+    df = pd.DataFrame(
+        {
+            "timestamp": pd.date_range("2018-01-01", periods=48, freq="h"),
+            "value": [1.0] * 23 + [None] * 25,
+        }
+    )
+    ForecastWeatherData.upsert_df(df)
+    assert not ForecastWeatherData.is_prepared()
+    ForecastWeatherData.upsert_df(df.fillna(1.0).tail(1))
+    assert ForecastWeatherData.is_prepared() == {
+        "start_date": datetime(2018, 1, 1, 0),
+        "end_date": datetime(2018, 1, 2, 23),
+    }
+    pytest.init_db()
+
     pytest.load_demo_db(app)
 
     # FORECAST MODEL
@@ -220,3 +641,119 @@ def test_to_df(app, db):
         HistoricalLoadData.to_df(),
     ]
     assert all([df.shape[0] > 20 for df in dfs])
+    assert all([df["dates"].is_monotonic_increasing for df in dfs])
+    assert HistoricalLoadData.to_df()["load"].dtype == "float64"
+
+    # Only return the requested window
+    df = HistoricalLoadData.to_df(
+        start=datetime(2018, 1, 1, 0), end=datetime(2018, 1, 1, 23)
+    )
+    assert df.shape[0] == 24
+    assert df["dates"].min() == datetime(2018, 1, 1, 0)
+    assert df["dates"].max() == datetime(2018, 1, 1, 23)
+    assert HistoricalLoadData.to_df(start=datetime(2018, 12, 19, 6)).shape[0] == 1
+
+
+def cached_df(cls):
+    """Return the dataframe of the table cached by `to_df`, or None."""
+    return cls._cache.get((cls.__tablename__, "df"), (None, None))[1]
+
+
+def test_to_df_cache(app, db):
+    # Tables that were never stamped, e.g. in older databases, are stamped when read
+    assert HistoricalLoadData.get_version() is None
+    HistoricalLoadData.to_df()
+    version = HistoricalLoadData.get_version()
+    assert version is not None
+    assert HistoricalLoadData.stamp_version() == version
+
+    pytest.load_demo_db(app)
+    df = HistoricalLoadData.to_df()
+    cached = cached_df(HistoricalLoadData)
+    assert cached is not None
+    HistoricalLoadData.to_df()
+    assert cached_df(HistoricalLoadData) is cached
+
+    # Callers get a copy, so modifying it leaves the cache intact
+    assert df is not cached
+    df["load"] = 0
+    df.drop(index=df.index[:10], inplace=True)
+    assert HistoricalLoadData.to_df().equals(cached)
+    assert (cached["load"] != 0).any()
+
+    # Uploading data invalidates the cache
+    version = HistoricalLoadData.get_version()
+    HistoricalLoadData.load_data(pytest.FIXTURE_DIR / "historical-load-update.csv")
+    assert HistoricalLoadData.get_version() != version
+    updated_df = HistoricalLoadData.to_df()
+    assert cached_df(HistoricalLoadData) is not cached
+    assert updated_df.shape[0] > cached.shape[0]
+
+    # As does a change made by another process
+    cached = cached_df(HistoricalLoadData)
+    HistoricalLoadData.bump_version()
+    db.session.commit()
+    HistoricalLoadData.to_df()
+    assert cached_df(HistoricalLoadData) is not cached
+
+    # Other tables are unaffected
+    HistoricalWeatherData.to_df()
+    cached = cached_df(HistoricalWeatherData)
+    HistoricalLoadData.bump_version()
+    db.session.commit()
+    HistoricalWeatherData.to_df()
+    assert cached_df(HistoricalWeatherData) is cached
+
+
+def legacy_parse_dates(df, DATE_COL, HOUR_COL):
+    """The original row-wise implementation of `TrainingData._parse_dates`."""
+    df[DATE_COL] = pd.to_datetime(df[DATE_COL])
+    df[HOUR_COL] = df[HOUR_COL].astype(str).str.replace("00", "").astype(int)
+    if any(24 == df[HOUR_COL]):
+        df[HOUR_COL] -= 1
+    df["timestamp"] = df.apply(
+        lambda row: datetime(
+            row[DATE_COL].year, row[DATE_COL].month, row[DATE_COL].day, row[HOUR_COL]
+        ),
+        axis=1,
+    )
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    df.drop_duplicates(subset=["timestamp"], inplace=True)
+    df = df.set_index("timestamp")
+    df = df.resample("h").last()
+    df["timestamp"] = df.index
+    return df
+
+
+# Map an hour (0-23) to how it's written in each of the supported upload formats
+HOUR_FORMATS = {
+    "HH00": lambda hour: hour * 100,
+    "H": lambda hour: hour,
+    "HE": lambda hour: hour + 1,
+}
+
+
+@settings(max_examples=50, deadline=None)
+@given(
+    hour_format=st.sampled_from(sorted(HOUR_FORMATS)),
+    rows=st.lists(
+        st.tuples(
+            st.dates(min_value=date(2000, 1, 1), max_value=date(2000, 1, 10)),
+            st.integers(min_value=0, max_value=23),
+            st.floats(allow_nan=True, allow_infinity=False, width=32),
+        ),
+        min_size=1,
+        max_size=100,
+    ),
+)
+def test_parse_dates(hour_format, rows):
+    df = pd.DataFrame(
+        {
+            "date": [day.isoformat() for day, _, _ in rows],
+            "hour": [HOUR_FORMATS[hour_format](hour) for _, hour, _ in rows],
+            "kw": [value for _, _, value in rows],
+        }
+    )
+    expected = legacy_parse_dates(df.copy(), "date", "hour")
+    result = HistoricalLoadData._parse_dates(df.copy(), "date", "hour")
+    pd.testing.assert_frame_equal(result, expected)
@@ -0,0 +1,68 @@
+import os
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+import forecast_app.forecast as lf
+from forecast_app.serving import ModelCache
+
+
+@pytest.fixture(scope="module")
+def forecast_models(tmp_path_factory):
+    """Mock forecast models with small saved keras models."""
+    tmp_path = tmp_path_factory.mktemp("models")
+    models = []
+    for i in range(3):
+        model_file = str(tmp_path / f"model-{i}.h5")
+        lf.build_model(3).save(model_file)
+        models.append(Mock(slug=f"model-{i}", model_file=model_file))
+    return models
+
+
+def test_model_cache(forecast_models):
+    first, second, third = forecast_models
+    cache = ModelCache(max_models=2)
+    model = cache.get(first)
+    assert cache.get(first) is model
+    assert cache.nbytes == model.count_params() * 4
+
+    # The least recently used model is evicted
+    cache.get(second)
+    cache.get(first)
+    cache.get(third)
+    assert "model-0" in cache and "model-2" in cache
+    assert "model-1" not in cache
+
+    # ... as are models over the memory bound, except the last one used
+    cache.max_bytes = 1
+    cache.get(second)
+    assert len(cache) == 1 and "model-1" in cache
+
+    cache.evict("model-1")
+    assert len(cache) == 0
+
+
+def test_model_cache_files(forecast_models, tmp_path):
+    cache = ModelCache()
+    model_file = str(tmp_path / "model.h5")
+    forecast_model = Mock(slug="model", model_file=model_file)
+    assert cache.get(forecast_model) is None
+
+    lf.build_model(3).save(model_file)
+    model = cache.get(forecast_model)
+    X = np.zeros((2, 24, 3), dtype=np.float32)
+    assert cache.predict(forecast_model, X).shape == (2, 24)
+
+    # Changed models are reloaded ...
+    lf.build_model(3).save(model_file)
+    os.utime(model_file, (0, 0))
+    assert cache.get(forecast_model) is not model
+
+    # ... and removed models are evicted
+    cache.get(forecast_models[0])
+    os.remove(model_file)
+    cache.get(forecast_models[0])
+    assert "model" not in cache
+    with pytest.raises(Exception, match="has no saved model"):
+        cache.predict(forecast_model, X)
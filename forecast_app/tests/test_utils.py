@@ -3,6 +3,7 @@ import re
 from datetime import datetime
 from unittest.mock import patch
 
+import numpy as np
 import pandas as pd
 import pytest
 from flask import request
@@ -10,7 +11,12 @@ from werkzeug.datastructures import FileStorage
 
 import forecast_app
 from forecast_app import create_app
-from forecast_app.utils import allowed_file, prepare_filename_for_upload, upload_file
+from forecast_app.utils import (
+    allowed_file,
+    downsample_min_max,
+    prepare_filename_for_upload,
+    upload_file,
+)
 
 
 # TEST CONFIG
@@ -63,3 +69,26 @@ def test_prepare_filename_for_upload():
     assert new_filename.endswith(".csv")
     assert new_filename.startswith("historical-load.test-t.t-t.")
     assert re.match(r"historical-load\.test-t\.t-t\..*\.csv", new_filename)
+
+
+def test_downsample_min_max():
+    values = np.sin(np.linspace(0, 20, 10000))
+    values[5000] = 42
+    values[6000:7000] = np.nan
+
+    # Small series are untouched
+    assert list(downsample_min_max(values[:100], 200)) == list(range(100))
+
+    indices = downsample_min_max(values, 200)
+    assert len(indices) <= 200
+    assert all(np.diff(indices) > 0)
+    # Peaks and gaps are kept
+    assert 5000 in indices
+    assert np.nanmax(values[indices]) == 42
+    assert np.nanmin(values[indices]) == np.nanmin(values)
+    assert np.isnan(values[indices]).any()
+
+    # At most one point is the peak
+    assert list(downsample_min_max(values, 1)) == [5000]
+    assert list(downsample_min_max(values, 0)) == []
+    assert list(downsample_min_max(np.full(10, np.nan), 1)) == [0]
@@ -1,19 +1,29 @@
+import io
+import os
 from datetime import date, datetime
+from pathlib import Path
+from unittest.mock import patch
 
+import numpy as np
 import pandas as pd
 import pytest
 from flask import request
+from sqlalchemy import inspect
 from werkzeug.datastructures import FileStorage
 
+import forecast_app.forecast as lf
 from forecast_app.commands import init_db, upload_demo_data
 from forecast_app.models import (
     ForecastModel,
     ForecastWeatherData,
     HistoricalLoadData,
     HistoricalWeatherData,
+    TrainingJob,
 )
+from forecast_app.serving import model_cache
 from forecast_app.views import (
     ForecastModelDetailView,
+    ForecastModelListView,
     ForecastWeatherDataSync,
     ForecastWeatherDataView,
     HistoricalLoadDataView,
@@ -112,9 +122,54 @@ class TestDataViews:
         assert summary["end_datetime"] == datetime(2002, 1, 3, 8, 0, 0)
         assert summary["max_span"] == 3
 
-    def test_get_table(self):
-        # TODO: Test that descending order
-        pass
+    def test_get_table(self, db):
+        table = HistoricalLoadDataView().get_table()
+        assert table["rows"] == []
+        assert table["older_cursor"] is None and table["newer_cursor"] is None
+
+        HistoricalLoadData.load_data(pytest.FIXTURE_DIR / "historical-load.csv")
+        view = HistoricalLoadDataView()
+        first_page = view.get_table(page_size=50)
+        timestamps = [row["timestamp"] for row in first_page["rows"]]
+        assert len(timestamps) == 50
+        assert timestamps == sorted(timestamps, reverse=True)
+        assert timestamps[0] == datetime(2002, 1, 3, 23)
+        assert first_page["newer_cursor"] is None
+
+        cursor = datetime.fromisoformat(first_page["older_cursor"])
+        second_page = view.get_table(cursor=cursor, page_size=50)
+        assert len(second_page["rows"]) == 22
+        assert second_page["rows"][0]["timestamp"] < timestamps[-1]
+        assert second_page["older_cursor"] is None
+
+        # Going back returns the first page
+        cursor = datetime.fromisoformat(second_page["newer_cursor"])
+        assert view.get_table(cursor=cursor, direction="newer", page_size=50) == (
+            first_page
+        )
+
+    def test_get_table_pages(self, db, app, client, auth):
+        auth.login()
+        HistoricalLoadData.load_data(pytest.FIXTURE_DIR / "historical-load.csv")
+        response = client.get("/historical-load-data?page_size=10")
+        assert response.status_code == 200
+        assert "2002-01-03 23:00:00" in str(response.data)
+        assert "2002-01-03 13:00:00" not in str(response.data)
+        assert "direction=older" in str(response.data)
+
+        response = client.get(
+            "/historical-load-data?page_size=10&cursor=2002-01-03T14:00:00"
+        )
+        assert "2002-01-03 13:00:00" in str(response.data)
+        assert "direction=newer" in str(response.data)
+
+        # A negative page size would remove the limit on the rows fetched
+        for query in ["page_size=-2", "page_size=0", "page_size=x", "cursor=x"]:
+            response = client.get(f"/historical-load-data?{query}")
+            assert response.status_code == 400
+        for page_size in [-2, 0]:
+            with pytest.raises(ValueError, match="page_size"):
+                HistoricalLoadDataView().get_table(page_size=page_size)
 
     def test_get_summary(self, db, app):
         for cls in self.classes:
@@ -127,12 +182,19 @@ class TestDataViews:
         assert forecast_summary["start_datetime"] == datetime(2018, 12, 18, 0, 0)
         assert forecast_summary["end_datetime"] == datetime(2018, 12, 21, 23, 0, 0)
         assert forecast_summary["missing_values"]["count"] == 0
+        assert forecast_summary["missing_values"]["max_span"] == 0
 
         init_db()
         HistoricalLoadData.load_data(pytest.FIXTURE_DIR / "uncontinuous.csv")
         load_summary = HistoricalLoadDataView().get_summary()
+        assert load_summary["count"] == 72
         assert load_summary["missing_values"]["count"] == 6
 
+        # The summary is cached until the table changes
+        assert HistoricalLoadDataView().get_summary() is load_summary
+        HistoricalLoadData.load_data(pytest.FIXTURE_DIR / "historical-load-update.csv")
+        assert HistoricalLoadDataView().get_summary() is not load_summary
+
     def test_get_chart(self, db, app):
         for cls in self.classes:
             chart_array = cls().get_chart()
@@ -143,6 +205,30 @@ class TestDataViews:
             chart = cls().get_chart()
             assert type(chart[0]) == dict
             assert all([len(datapoint) == 2 for datapoint in chart[0]["data"]])
+            assert len(chart[0]["data"]) <= cls.chart_max_points
+
+        # Request a single day at full resolution
+        start = pd.Timestamp(2018, 1, 1).timestamp() * 1000
+        end = pd.Timestamp(2018, 1, 1, 23).timestamp() * 1000
+        chart = HistoricalLoadDataView().get_chart(start=start, end=end)
+        assert len(chart[0]["data"]) == 24
+        assert chart[0]["data"][0][0] == start
+        chart = HistoricalLoadDataView().get_chart(start=start, end=end, max_points=6)
+        assert len(chart[0]["data"]) <= 6
+
+    def test_chart_endpoint(self, db, app, client, auth):
+        auth.login()
+        pytest.load_demo_db(app)
+        response = client.get("/historical-load-data/chart?max_points=100")
+        assert response.status_code == 200
+        assert 0 < len(response.json[0]["data"]) <= 100
+
+        # The full resolution can't be requested
+        max_points = HistoricalLoadDataView.chart_max_points
+        response = client.get(f"/historical-load-data/chart?max_points={10**6}")
+        assert 0 < len(response.json[0]["data"]) <= max_points
+        response = client.get("/historical-load-data/chart?max_points=0")
+        assert response.status_code == 400
 
     def post_data_view(self, cls, filename=None, final_count=None):
         src_path = pytest.FIXTURE_DIR / filename
@@ -196,14 +282,140 @@ class TestForecastListView:
         assert ForecastModel.query.count() == 1
         # See test_subprocessing for more tests
 
-    def test_get(self):
-        pass
+    def test_post_queue(self, app, db, client, auth):
+        auth.login()
+        upload_demo_data(models=False)
+        with patch("forecast_app.models.spawn") as spawn:
+            spawn.Process.return_value.pid = os.getpid()
+            client.post("/forecast-models")
+            response = client.post("/forecast-models", follow_redirects=True)
+        assert "An identical model is already queued." in str(response.data)
+        assert ForecastModel.query.count() == 1
+        assert ForecastModel.query.first().is_queued
+        assert spawn.Process.call_count == 1
+        # See TestTrainingJob for more tests
+
+    def test_forecast_only(self, app, db, client, auth):
+        auth.login()
+        pytest.load_demo_db(app)
+        model_count = ForecastModel.query.count()
+        # The demo models can't be reused because they weren't trained
+        # NOTE: Errors are raised rather than flashed in debug mode
+        with pytest.raises(Exception, match="Cannot forecast without training"):
+            client.post("/forecast-models", data={"forecast_only": "true"})
+        assert ForecastModel.query.count() == model_count
+
+        # A failed forecast is stored as a failure
+        previous = ForecastModel.get_latest_successful()
+        with patch.object(
+            ForecastModel, "get_reusable_model", return_value=(previous, None, None)
+        ), patch.object(
+            ForecastModel, "execute_inference", side_effect=Exception("No memory")
+        ):
+            with pytest.raises(Exception, match="failed to forecast: No memory"):
+                client.post("/forecast-models", data={"forecast_only": "true"})
+        assert ForecastModel.query.count() == model_count + 1
+        failed_model = ForecastModel.query.order_by(
+            ForecastModel.creation_date.desc()
+        ).first()
+        assert failed_model.status == ForecastModel.FAILURE
+        assert failed_model.job.exit_reason == "No memory"
+        # See test_execute_inference for more tests
+
+    def test_get_models(self, app, db):
+        pytest.load_demo_db(app)
+        creation_dates = [
+            model.creation_date
+            for model in ForecastModel.query.order_by(ForecastModel.creation_date)
+        ]
+        assert len(creation_dates) == 3
+
+        view = ForecastModelListView()
+        first_page = view.get_models(page_size=2)
+        assert [model.creation_date for model in first_page["models"]] == (
+            creation_dates[:0:-1]
+        )
+        assert first_page["newer_cursor"] is None
+        # The heavy JSON columns aren't loaded with the list
+        assert "loads" not in inspect(first_page["models"][0]).dict
+
+        cursor = datetime.fromisoformat(first_page["older_cursor"])
+        second_page = view.get_models(cursor=cursor, page_size=2)
+        assert [model.creation_date for model in second_page["models"]] == (
+            creation_dates[:1]
+        )
+        assert second_page["older_cursor"] is None
+
+        # Going back returns the first page
+        cursor = datetime.fromisoformat(second_page["newer_cursor"])
+        assert view.get_models(cursor=cursor, direction="newer", page_size=2) == (
+            first_page
+        )
+
+        for page_size in [-2, 0]:
+            with pytest.raises(ValueError, match="page_size"):
+                view.get_models(page_size=page_size)
+
+    def test_get(self, app, db, client, auth):
+        auth.login()
+        pytest.load_demo_db(app)
+        response = client.get("/forecast-models?page_size=1")
+        assert response.status_code == 200
+        assert "direction=older" in str(response.data)
+        assert "direction=newer" not in str(response.data)
+        for query in ["page_size=-2", "page_size=0", "cursor=x", "direction=x"]:
+            assert client.get(f"/forecast-models?{query}").status_code == 400
+
+        # Each queued model has its own cancel form
+        models = ForecastModel.query.limit(2).all()
+        for model in models:
+            model.store_status(model.QUEUED)
+        # Viewing the queue doesn't start workers for it
+        with patch.object(TrainingJob, "dispatch") as dispatch:
+            response = client.get("/forecast-models")
+        dispatch.assert_not_called()
+        for model in models:
+            form_id = f"cancelModel-{model.slug}"
+            assert str(response.data).count(form_id) == 2
 
 
 class TestForecastModelDetailView:
     def test_get(self):
         pass
 
+    def test_get_ensemble(self, app, db, client, auth):
+        auth.login()
+        pytest.load_demo_db(app)
+        model = ForecastModel.query.first()
+        df = model.get_df()
+        try:
+            model.store_df(
+                df.assign(
+                    forecasted_load_lower=df["forecasted_load"] * 0.9,
+                    forecasted_load_upper=df["forecasted_load"] * 1.1,
+                )
+            )
+            response = client.get(f"/forecast-models/{model.slug}")
+        finally:
+            model.store_df(df)
+        assert response.status_code == 200
+        assert "Ensemble lower bound" in str(response.data)
+        assert "Ensemble upper bound" in str(response.data)
+        # Only the series types of highstock.js are loaded, see base.html
+        assert "arearange" not in str(response.data)
+
+    def test_download_csv(self, app, db, client, auth):
+        auth.login()
+        pytest.load_demo_db(app)
+        model = ForecastModel.query.first()
+        response = client.get(
+            f"/forecast-models/{model.slug}/output/{model.csv_df_filename}"
+        )
+        assert response.status_code == 200
+        assert response.mimetype == "text/csv"
+        df = pd.read_csv(io.BytesIO(response.data), parse_dates=["dates"])
+        assert df.equals(model.get_df())
+
     def test_post(self, app, db, client, auth):
         auth.login()
         upload_demo_data(models=False)
@@ -216,6 +428,49 @@ class TestForecastModelDetailView:
         assert model.status == model.FAILURE
 
 
+class TestForecastModelPredictView:
+    def test_post(self, app, db, client, auth):
+        auth.login()
+        pytest.load_demo_db(app)
+        model = ForecastModel.query.first()
+        url = f"/forecast-models/{model.slug}/predict"
+        X = np.zeros((2, 24, len(lf.FEATURE_COLUMNS))).tolist()
+
+        # The demo models weren't trained
+        response = client.post(url, json={"X": X})
+        assert response.status_code == 409
+
+        lf.build_model(len(lf.FEATURE_COLUMNS)).save(model.model_file)
+        response = client.post(url, json={"X": X})
+        assert response.status_code == 200
+        assert np.array(response.json["predictions"]).shape == (2, 24)
+        assert model.slug in model_cache
+
+        response = client.post(url, json={"X": X[0]})
+        assert response.status_code == 400
+        response = client.post(url, json={})
+        assert response.status_code == 400
+
+        # Models that fail to predict are server errors
+        with patch.object(
+            ForecastModel, "predict", side_effect=Exception("Corrupt model")
+        ):
+            response = client.post(url, json={"X": X})
+        assert response.status_code == 500
+        assert response.json["error"] == "Corrupt model"
+
+        # Deleting the model evicts it
+        model.delete()
+        assert model.slug not in model_cache
+        response = client.post(url, json={"X": X})
+        assert response.status_code == 404
+
+        # HACK: Put the model's files back, see test_delete
+        os.makedirs(model.output_dir)
+        demo_data = Path("forecast_app/static/demo-data")
+        model.store_df(pd.read_csv(demo_data / "cached-dataframe.csv"))
+
+
 class TestHistoricalWeatherDataSync:
     def test_build_request(self, app, db):
         request = HistoricalWeatherDataSync().build_request()
@@ -2,6 +2,7 @@
 import logging
 import os
 
+import numpy as np
 import pandas as pd
 from flask import current_app, flash, has_request_context, request
 from flask_login import LoginManager, UserMixin
@@ -102,3 +103,79 @@ def safe_flash(message, category):
             logging.log(msg=message, level=categories[category])
         else:
             flash(message, category)
+
+
+def downsample_min_max(values, max_points):
+    """Reduce a timeseries of `values` to at most `max_points` points, keeping each bucket's min and max.
+
+    Unlike averaging, this keeps peaks (like monthly load peaks) intact. Buckets
+    with only null values are kept as a single null point so gaps stay visible.
+    Return the indices of the points to keep, in order.
+    """
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+    if max_points < 2:
+        # A bucket's min and max would be two points, so only keep the peak
+        if max_points < 1:
+            return np.arange(0)
+        if np.isnan(values).all():
+            return np.arange(1)
+        return np.array([np.nanargmax(values)])
+
+    # Each bucket contributes up to two points
+    bucket_size = int(np.ceil(n / (max_points // 2)))
+    n_buckets = int(np.ceil(n / bucket_size))
+    padded = np.full(n_buckets * bucket_size, np.nan)
+    padded[:n] = values
+    buckets = padded.reshape(n_buckets, bucket_size)
+
+    is_null = np.isnan(buckets)
+    offsets = np.arange(n_buckets) * bucket_size
+    mins = offsets + np.argmin(np.where(is_null, np.inf, buckets), axis=1)
+    maxes = offsets + np.argmax(np.where(is_null, -np.inf, buckets), axis=1)
+    all_null = is_null.all(axis=1)
+
+    indices = np.concatenate([mins[~all_null], maxes[~all_null], offsets[all_null]])
+    return np.unique(indices)
+
+
+def keyset_page(query, column, key, cursor=None, direction="older", page_size=100):
+    """Return one page of the query's results, in descending order of `column`.
+
+    Pages are found by the `column` value `cursor` that they come directly before
+    (if `direction` is "older") or after (if "newer"), so no rows are skipped with
+    an OFFSET. `key` returns a result's `column` value. Return the results and the
+    cursors (ISO strings) of the adjacent pages, or None for either cursor if there
+    is no such page. Raise a ValueError if `page_size` isn't positive.
+    """
+    # NOTE: SQLite treats a negative LIMIT as no limit
+    if page_size <= 0:
+        raise ValueError("page_size must be positive.")
+
+    if direction == "newer" and cursor is not None:
+        query = query.filter(column > cursor).order_by(column)
+    else:
+        direction = "older"
+        if cursor is not None:
+            query = query.filter(column < cursor)
+        query = query.order_by(column.desc())
+
+    # Request an extra result to find out if there's another page
+    results = query.limit(page_size + 1).all()
+    has_more = len(results) > page_size
+    results = results[:page_size]
+    if direction == "newer":
+        results.reverse()
+
+    if direction == "older":
+        has_older, has_newer = has_more, cursor is not None
+    else:
+        has_older, has_newer = True, has_more
+
+    return {
+        "results": results,
+        "older_cursor": key(results[-1]).isoformat() if results and has_older else None,
+        "newer_cursor": key(results[0]).isoformat() if results and has_newer else None,
+        "page_size": page_size,
+    }
@@ -7,8 +7,12 @@ from datetime import date, timedelta
 from multiprocessing import Process
 
 import flask_login
+import numpy as np
+import pandas as pd
 from flask import (
+    Response,
     current_app,
+    jsonify,
     redirect,
     render_template,
     request,
@@ -16,18 +20,54 @@ from flask import (
     url_for,
 )
 from flask.views import MethodView, View
-from sqlalchemy import desc
+from sqlalchemy.orm import joinedload
 
-from forecast_app import burtcoppd
+import forecast_app.forecast as lf
 from forecast_app.models import (
     ForecastModel,
     ForecastWeatherData,
     HistoricalLoadData,
     HistoricalWeatherData,
+    TrainingJob,
+)
+from forecast_app.utils import (
+    ADMIN_USER,
+    db,
+    downsample_min_max,
+    keyset_page,
+    safe_flash,
+    upload_file,
 )
-from forecast_app.utils import ADMIN_USER, db, safe_flash, upload_file
 from forecast_app.weather import AsosRequest, NwsForecastRequest
 
+
+def page_request_args():
+    """Return the `cursor`, `direction` and `page_size` of the request, see `keyset_page`.
+
+    Raise a ValueError if any of them is malformed, rather than ignoring it.
+    """
+    args = {"direction": request.args.get("direction", "older")}
+    if args["direction"] not in ["older", "newer"]:
+        raise ValueError("direction must be older or newer.")
+
+    cursor = request.args.get("cursor")
+    try:
+        args["cursor"] = (
+            None if cursor is None else datetime.datetime.fromisoformat(cursor)
+        )
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+    page_size = request.args.get("page_size")
+    try:
+        args["page_size"] = None if page_size is None else int(page_size)
+    except ValueError:
+        raise ValueError(f"Invalid page_size: {page_size}")
+    if args["page_size"] is not None and args["page_size"] <= 0:
+        raise ValueError("page_size must be positive.")
+    return args
+
+
 # TODO: Set default ordering to milliseconds / timestamps to prevent chart mixups
 
 
@@ -42,62 +82,64 @@ class DataView(MethodView):
     gist_example = None
     # Variable for whether user can sync data with external API
     sync_request = None
+    # Maximum number of points rendered in the chart at once
+    chart_max_points = 2000
+    # Number of rows rendered in the table at once, unless requested otherwise
+    table_page_size = 100
+    table_max_page_size = 1000
 
     def get_missing_values_summary(self):
         """Collect basic information about missing values in the given model"""
-        df = self.model.to_df()
-        col = self.model.column_name
-
-        df = df.set_index("dates")
-        cumulative_df = (
-            df[col]
-            .isnull()
-            .astype(int)
-            .groupby(df[col].notnull().astype(int).cumsum())
-            .cumsum()
-        )
-        max_span = cumulative_df.max()
-        end_datetime = cumulative_df.idxmax()
-        # NOTE: timedelta can't take numpy.int64
-        start_datetime = end_datetime - datetime.timedelta(hours=int(max_span - 1))
-        return {
-            "count": df[col].isna().sum(),
-            "max_span": max_span,
-            "start_datetime": start_datetime,
-            "end_datetime": end_datetime,
-        }
+        summary = self.model.get_summary()
+        return summary["missing_values"] if summary else None
 
     def get_summary(self):
         """Return dictionary for the data views "Data Summary" section."""
-        if self.model.query.count() == 0:
-            return None
+        return self.model.get_summary()
 
-        return {
-            "count": self.model.query.count(),
-            "start_datetime": self.model.query.order_by(self.model.timestamp)
-            .first()
-            .timestamp,
-            "end_datetime": self.model.query.order_by(self.model.timestamp.desc())
-            .first()
-            .timestamp,
-            "missing_values": self.get_missing_values_summary(),
-        }
+    def get_table(self, cursor=None, direction="older", page_size=None):
+        """Put one page of data into a format that can be rendered by jinja as a table
 
-    def get_table(self):
-        """Put data into a format that can be rendered by jinja as a table"""
-        query = db.session.query(
+        Rows are in descending order, see `keyset_page` for the `cursor`, `direction`
+        and `page_size`. Return the rows and the cursors of the adjacent pages.
+        """
+        page = keyset_page(
+            db.session.query(self.model.timestamp, self.model.value),
             self.model.timestamp,
-            self.model.value,
+            key=lambda row: row[0],
+            cursor=cursor,
+            direction=direction,
+            page_size=self.table_page_size
+            if page_size is None
+            else min(page_size, self.table_max_page_size),
         )
-        query = query.order_by(desc(self.model.timestamp))
-        return [{"timestamp": timestamp, "value": value} for timestamp, value in query]
-
-    def get_chart(self):
-        """Put data into a format that can be rendered by highstock as a chart"""
-        query = db.session.query(self.model.milliseconds, self.model.value).order_by(
-            self.model.milliseconds
+        rows = page.pop("results")
+        page["rows"] = [
+            {"timestamp": timestamp, "value": value} for timestamp, value in rows
+        ]
+        return page
+
+    def get_chart(self, start=None, end=None, max_points=None):
+        """Put data into a format that can be rendered by highstock as a chart
+
+        `start` and `end` limit the chart to a range of milliseconds. The data is
+        downsampled to at most `max_points` points (capped at `chart_max_points`),
+        keeping the peaks.
+        """
+        max_points = min(max_points or self.chart_max_points, self.chart_max_points)
+        df = self.model.to_df(
+            start=None if start is None else pd.to_datetime(start, unit="ms"),
+            end=None if end is None else pd.to_datetime(end, unit="ms"),
         )
-        data = [list(row) for row in query]
+        values = df[self.model.column_name].to_numpy()
+        indices = downsample_min_max(values, max_points)
+
+        milliseconds = (
+            df["dates"].to_numpy()[indices].astype("int64") // 10**6
+        ).tolist()
+        # NOTE: NaNs aren't valid JSON
+        values = [None if np.isnan(value) else value for value in values[indices]]
+        data = [list(row) for row in zip(milliseconds, values)]
         return [{"data": data, "name": self.model.column_name}]
 
     def post(self):
@@ -108,12 +150,16 @@ class DataView(MethodView):
 
     def get(self):
         """Render the data view"""
+        try:
+            table = self.get_table(**page_request_args())
+        except ValueError as e:
+            return str(e), 400
         # NOTE: Just pass self?
         return render_template(
             "data-view.html",
             **{
                 "name": self.view_name,
-                "table": self.get_table(),
+                "table": table,
                 "chart": self.get_chart(),
                 "title": self.title,
                 "gist_example": self.gist_example,
@@ -152,6 +198,54 @@ class HistoricalWeatherDataView(DataView):
     sync_request = "ASOS"
 
 
+class DataChart(MethodView):
+    """Abstract view that returns a data view's chart data as JSON.
+
+    The chart requests more detail from here as the user zooms in.
+    """
+
+    decorators = [flask_login.login_required]
+    view_name = None
+    view_url = None
+    parent_view = None
+
+    def get(self):
+        """Return the chart data for the requested range (`start` and `end` in milliseconds) and `max_points`."""
+        max_points = request.args.get("max_points", type=int)
+        if max_points is not None and max_points <= 0:
+            return jsonify({"error": "max_points must be positive."}), 400
+        chart = self.parent_view().get_chart(
+            start=request.args.get("start", type=int),
+            end=request.args.get("end", type=int),
+            max_points=max_points,
+        )
+        return jsonify(chart)
+
+
+class ForecastWeatherDataChart(DataChart):
+    """Chart data for the forecast weather data"""
+
+    view_name = "forecast-weather-data-chart"
+    view_url = "/forecast-weather-data/chart"
+    parent_view = ForecastWeatherDataView
+
+
+class HistoricalLoadDataChart(DataChart):
+    """Chart data for the historical load data"""
+
+    view_name = "historical-load-data-chart"
+    view_url = "/historical-load-data/chart"
+    parent_view = HistoricalLoadDataView
+
+
+class HistoricalWeatherDataChart(DataChart):
+    """Chart data for the historical weather data"""
+
+    view_name = "historical-weather-data-chart"
+    view_url = "/historical-weather-data/chart"
+    parent_view = HistoricalWeatherDataView
+
+
 class LatestForecastView(MethodView):
     """Masked redirect to the latest successful forecast model"""
 
@@ -160,21 +254,7 @@ class LatestForecastView(MethodView):
 
     def get_latest_successful_model(self):
         """Return the latest successful forecast model to show to user in this view"""
-        # NOTE: Need to do manually because of exited_successfully being a property
-        query = (
-            db.session.query(ForecastModel)
-            .order_by(desc(ForecastModel.creation_date))
-            .all()
-        )
-
-        for model in query:
-            if model.exited_successfully:
-                latest_successful_forecast = model
-                break
-        else:
-            latest_successful_forecast = None
-
-        return latest_successful_forecast
+        return ForecastModel.get_latest_successful()
 
     def get(self):
         """Redirect to the latest successful forecast model if one exists, otherwise show a page with message."""
@@ -246,29 +326,81 @@ class ForecastModelListView(MethodView):
     decorators = [flask_login.login_required]
     view_name = "forecast-model-list"
     view_url = "/forecast-models"
+    page_size = 20
+    max_page_size = 100
 
     def post(self):
         """Generate a new forecast model."""
-        # Use `quick_init` so we don't generate the dataframe until the subprocess
-        new_model = ForecastModel(quick_init=True)
-        new_model.save()
-        print(f"Starting model {new_model.creation_date}")
+        if request.values.get("forecast_only") == "true":
+            return self.forecast_only()
+
         # NOTE: For testing, send 'mock' as a parameter to avoid lengthy training
         # TODO: This is a hacky way to do this.
         if request.values.get("mock") == "true":
+            new_model = ForecastModel(quick_init=True)
+            new_model.save()
             process = Process(target=time.sleep, args=(3,))
+            process.start()
+            new_model.store_status(ForecastModel.RUNNING, pid=process.pid)
+            safe_flash("Model has begun training.", "info")
+            return redirect(url_for("forecast-model-list"))
+
+        new_model = TrainingJob.submit(current_app.config["NAME"])
+        if new_model is None:
+            safe_flash("An identical model is already queued.", "info")
         else:
-            process = Process(
-                target=new_model.launch_subprocess, args=(current_app.config["NAME"],)
-            )
-        process.start()
-        new_model.store_process_id(process.pid)
-        safe_flash("Model has begun training.", "info")
+            print(f"Queued model {new_model.creation_date}")
+            safe_flash(f"Model {new_model.slug} has been queued for training.", "info")
         return redirect(url_for("forecast-model-list"))
 
+    def forecast_only(self):
+        """Forecast with the latest successful model without training, this takes seconds."""
+        try:
+            reusable_model = ForecastModel.get_reusable_model(cached=True)
+        except Exception as e:
+            safe_flash(f"Cannot forecast without training: {e}", "danger")
+            return redirect(url_for("forecast-model-list"))
+
+        new_model = ForecastModel(quick_init=True)
+        try:
+            new_model.store_df(new_model.collect_training_data())
+            new_model.execute_inference(*reusable_model)
+        except Exception as e:
+            new_model.store_status(new_model.FAILURE, reason=str(e))
+            safe_flash(f"Model {new_model.slug} failed to forecast: {e}", "danger")
+            return redirect(url_for("forecast-model-list"))
+        safe_flash(
+            f"Model {new_model.slug} forecast with model {reusable_model[0].slug}.",
+            "success",
+        )
+        return redirect(url_for("forecast-model-list"))
+
+    def get_models(self, cursor=None, direction="older", page_size=None):
+        """Return one page of models, newest first, see `keyset_page`
+
+        Pages are found by the creation date `cursor`. Return the models and the
+        cursors of the adjacent pages.
+        """
+        page = keyset_page(
+            # NOTE: Load the jobs with the models to get all statuses in one query
+            ForecastModel.query.options(joinedload(ForecastModel.job)),
+            ForecastModel.creation_date,
+            key=lambda model: model.creation_date,
+            cursor=cursor,
+            direction=direction,
+            page_size=self.page_size
+            if page_size is None
+            else min(page_size, self.max_page_size),
+        )
+        page["models"] = page.pop("results")
+        return page
+
     def get(self):
-        """Render the list of all forecast models and show the state of all data views"""
-        models = ForecastModel.query.order_by(desc(ForecastModel.creation_date)).all()
+        """Render a page of forecast models and show the state of all data views"""
+        try:
+            pages = self.get_models(**page_request_args())
+        except ValueError as e:
+            return str(e), 400
         data_is_prepared = {
             "Historical load data": HistoricalLoadData.is_prepared(),
             "Historical weather data": HistoricalWeatherData.is_prepared(),
@@ -278,7 +410,8 @@ class ForecastModelListView(MethodView):
 
         return render_template(
             "forecast-model-list.html",
-            models=models,
+            models=pages["models"],
+            pages=pages,
             model_is_prepared=model_is_prepared,
             data_is_prepared=data_is_prepared,
         )
@@ -295,6 +428,18 @@ class DownloadModelFiles(MethodView):
         """Expose the model's output directory to the user and return a 404 if that file doesn't exist"""
         model = ForecastModel.query.filter_by(slug=slug).first()
         rel_path = os.path.join(model.output_dir, filename)
+        if (
+            model
+            and filename == model.csv_df_filename
+            and not os.path.exists(rel_path)
+            and os.path.exists(model.df_path)
+        ):
+            # Convert the parquet dataframe for download
+            return Response(
+                model.get_df().to_csv(index=False),
+                mimetype="text/csv",
+                headers={"Content-Disposition": f"attachment; filename={filename}"},
+            )
         if model and os.path.exists(rel_path):
             # NOTE: The absolute path is necessary to make file downloadable
             abs_dir_path = os.path.abspath(model.output_dir)
@@ -313,62 +458,13 @@ class ForecastModelDetailView(MethodView):
     def post(self, slug):
         """Cancel a specific model"""
         model = ForecastModel.query.filter_by(slug=slug).first()
-        if model.is_running:
+        if model.is_running or model.is_queued:
             model.cancel()
             safe_flash(f"Model {model.slug} was cancelled.", "info")
+            # Replace the worker of a cancelled model
+            TrainingJob.dispatch(current_app.config["NAME"])
         return redirect(url_for("forecast-model-list"))
 
-    def get_training_chart(self, df):
-        if df is None or ("forecasted_load" not in df.columns):
-            return None
-
-        df = df.sort_values("timestamp")
-        load_data = [[row.timestamp, row.load] for row in df.itertuples()]
-        forecast_data = [
-            [row.timestamp, row.forecasted_load] for row in df.itertuples()
-        ]
-        return [
-            {
-                "data": load_data,
-                "name": "Load",
-            },
-            {
-                "data": forecast_data,
-                "name": "Forecast",
-                "color": "blue",
-            },
-        ]
-
-    def get_forecast_chart(self, df):
-        if df is None or ("forecasted_load" not in df.columns):
-            return None
-
-        df = df.sort_values("timestamp")
-        # Get end of load data
-        lvi = df["load"].last_valid_index()
-        CONTEXT = 72
-        context_data = [
-            [row.timestamp, row.load]
-            for row in df.iloc[lvi - CONTEXT : lvi].itertuples()
-        ]
-        forecast_data = [
-            [row.timestamp, row.forecasted_load]
-            # lvi - 1 because it's nicer to see the chart connected to historical data
-            for row in df.iloc[lvi - 1 :].itertuples()
-        ]
-
-        return [
-            {
-                "data": context_data,
-                "name": "Load",
-            },
-            {
-                "data": forecast_data,
-                "name": "Forecast",
-                "color": "blue",
-            },
-        ]
-
     def get_highest_monthly_peak(self, df, model):
         """Get the peak load for the month"""
         if model is None:
@@ -388,24 +484,62 @@ class ForecastModelDetailView(MethodView):
     def get(self, slug):
         forecast_model = ForecastModel.query.filter_by(slug=slug).first()
 
-        # NOTE: Easier to just munge one dataframe for all queries
-        #  more efficient to request dataframe once
-        if forecast_model:
-            df = forecast_model.get_df()
-            df["timestamp"] = df.dates.apply(lambda x: x.timestamp() * 1000)
-        else:
-            df = None
+        # NOTE: The page's data is precomputed when the model finishes training
+        payload = forecast_model.get_detail_payload() if forecast_model else {}
 
         return render_template(
             "forecast-model-detail.html",
             name="forecast",
-            forecast_chart=self.get_forecast_chart(df),
-            training_chart=self.get_training_chart(df),
-            peak_info=burtcoppd.get_on_and_off_peak_info(df, forecast_model),
+            forecast_chart=payload.get("forecast_chart"),
+            training_chart=payload.get("training_chart"),
+            peak_info=payload.get("peak_info"),
+            accuracy=payload.get("accuracy"),
             forecast_model=forecast_model,
         )
 
 
+class ForecastModelPredictView(MethodView):
+    """Local API to predict with a trained model, served from the in-memory model cache"""
+
+    view_name = "forecast-model-predict"
+    view_url = "/forecast-models/<slug>/predict"
+    decorators = [flask_login.login_required]
+
+    def post(self, slug):
+        """Return the predicted load of the next day for each window of features in the JSON "X".
+
+        "X" has the shape [windows, HOURS_PRIOR, features], see `lf.build_features`.
+        """
+        model = ForecastModel.query.filter_by(slug=slug).first()
+        if model is None:
+            return jsonify({"error": f"Model {slug} does not exist."}), 404
+
+        expected_shape = (current_app.config["HOURS_PRIOR"], len(lf.FEATURE_COLUMNS))
+        try:
+            X = np.asarray(request.get_json()["X"], dtype=np.float32)
+        except (KeyError, TypeError, ValueError):
+            X = None
+        if X is None or X.ndim != 3 or X.shape[1:] != expected_shape:
+            return (
+                jsonify(
+                    {"error": f"X must have the shape [windows, *{expected_shape}]."}
+                ),
+                400,
+            )
+
+        if not os.path.exists(model.model_file):
+            return jsonify({"error": f"Model {slug} has no saved model."}), 409
+        try:
+            predictions = model.predict(X)
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        return jsonify({"predictions": predictions.tolist()})
+
+    def get(self, slug):
+        """Redirect any GET requests to the model's detail page."""
+        return redirect(url_for("forecast-model-detail", slug=slug))
+
+
 class DataSync(MethodView):
     """Abstract view to handle data syncing with external APIs."""
 